@@ -1,19 +1,25 @@
 #!/usr/bin/env python3
-import json
+import orjson
 import time
 import threading
 import websocket
 import os
-from datetime import datetime
+import queue
+from collections import Counter
+from datetime import datetime, timedelta
 from clickhouse_driver import Client
 from config import (
     MEXC_WS_URL, PING_INTERVAL, RECONNECT_DELAY, MAX_RECONNECT_ATTEMPTS,
     CLICKHOUSE_HOST, CLICKHOUSE_PORT, CLICKHOUSE_USER,
-    CLICKHOUSE_PASSWORD, CLICKHOUSE_DATABASE, 
-    MessageType, STATS_INTERVAL, MAX_ERROR_COUNT, ETH_CONFIG
+    CLICKHOUSE_PASSWORD, CLICKHOUSE_DATABASE, CLICKHOUSE_COMPRESSION,
+    MessageType, STATS_INTERVAL, MAX_ERROR_COUNT, FLUSH_BLOCK_SIZE,
+    INSERT_BATCH_SIZE, INSERT_BATCH_WINDOW, ETH_CONFIG
 )
 from ip_verification import verify_ip_uniqueness, wait_for_tor_proxy
 
+# Keepalive request encoded once instead of on every ping
+PING_FRAME = orjson.dumps({"method": "ping"})
+
 class EthDataPipeline:
     def __init__(self):
         self.ws = None
@@ -23,6 +29,24 @@ class EthDataPipeline:
         self.table_name = ETH_CONFIG["table_name"]
         self.base_name = ETH_CONFIG["base_name"]
         self.subscriptions = ETH_CONFIG["subscriptions"]
+        # Subscription requests are encoded once and resent as-is on every (re)connect
+        self.subscription_frames = tuple((sub['method'], orjson.dumps(sub)) for sub in self.subscriptions)
+        
+        # Query strings are fixed per table, so build them once instead of per message
+        self.insert_query = f"INSERT INTO {self.table_name} (ts, mt, m) VALUES"
+        self.exists_query = f"EXISTS TABLE {self.table_name}"
+        self.count_query = f"SELECT COUNT(*) FROM {self.table_name}"
+        self.row_count_query = "SELECT total_rows FROM system.tables WHERE database = currentDatabase() AND name = %(table)s"
+        self.range_count_query = f"SELECT count(*) FROM {self.table_name} WHERE ts >= %(min_ts)s AND ts < %(max_ts)s"
+        
+        # Push channel -> (message type, formatter, stats key), resolved with one dict lookup per frame
+        self.channel_handlers = {
+            'push.ticker': (MessageType.TICKER.value, self.format_ticker_data, 'ticker_count'),
+            'push.deal': (MessageType.DEAL.value, self.format_deal_data, 'deal_count'),
+            'push.depth': (MessageType.DEPTH.value, self.format_depth_data, 'depth_count'),
+            'push.depth.full': (MessageType.DEPTH.value, self.format_depth_data, 'depth_count'),
+        }
+        
         self.stats = {
             'total_records': 0,
             'ticker_count': 0,
@@ -33,12 +57,21 @@ class EthDataPipeline:
             'last_reset': time.time()
         }
         self.reconnect_count = 0
+        self.ping_stop = None  # Set on close to stop the current connection's ping thread
         
         # Memory buffer for zero data loss during rotation
         self.memory_buffer = []
         self.buffer_active = False
         self.rotation_flag_file = f"/tmp/{self.base_name}_rotate"
         self.buffer_lock = threading.Lock()
+        # The writer, rotation monitor and main threads share ch_client, and a
+        # clickhouse_driver Client is not thread-safe; execute_query serializes it
+        self.client_lock = threading.Lock()
+        
+        # Parsed messages wait here for the writer thread so ClickHouse round trips
+        # never stall the WebSocket receive thread
+        self.write_queue = queue.Queue()
+        self.writer_thread = None
         
         # Start rotation monitoring thread
         self.rotation_monitor_thread = threading.Thread(target=self.monitor_rotation_signal, daemon=True)
@@ -52,11 +85,12 @@ class EthDataPipeline:
                 port=CLICKHOUSE_PORT,
                 user=CLICKHOUSE_USER,
                 password=CLICKHOUSE_PASSWORD,
-                database=CLICKHOUSE_DATABASE
+                database=CLICKHOUSE_DATABASE,
+                compression=CLICKHOUSE_COMPRESSION
             )
             
             # Verify connection and table exists
-            table_exists = self.ch_client.execute(f"EXISTS TABLE {self.table_name}")[0][0]
+            table_exists = self.execute_query(self.exists_query)[0][0]
             
             if not table_exists:
                 print(f"❌ Table {self.table_name} missing - run setup_database.py first")
@@ -69,6 +103,11 @@ class EthDataPipeline:
             print(f"❌ Failed to connect to ClickHouse: {e}")
             return False
     
+    def execute_query(self, *args, **kwargs):
+        """Run a query on the shared ClickHouse client, one thread at a time."""
+        with self.client_lock:
+            return self.ch_client.execute(*args, **kwargs)
+    
     def monitor_rotation_signal(self):
         """Monitor for table rotation signal and manage memory buffer."""
         while True:
@@ -83,11 +122,10 @@ class EthDataPipeline:
                         # Wait for table rotation to complete
                         self.wait_for_table_rotation()
                         
-                        # Flush buffer to new table
-                        self.flush_buffer_to_new_table()
-                        
-                        # Deactivate buffer
+                        # Flush buffer to new table and deactivate it in one critical section,
+                        # so a batch stored between the two can't be cleared without being flushed
                         with self.buffer_lock:
+                            self.flush_buffer_to_new_table()
                             self.buffer_active = False
                             self.memory_buffer = []
                         
@@ -107,7 +145,7 @@ class EthDataPipeline:
         while wait_count < max_wait:
             try:
                 # Check if current table still exists (should be renamed to previous)
-                current_exists = self.ch_client.execute(f"EXISTS TABLE {self.table_name}")[0][0]
+                current_exists = self.execute_query(self.exists_query)[0][0]
                 if current_exists:
                     # Table was recreated - rotation complete
                     print(f"✅ New {self.table_name} table detected")
@@ -122,38 +160,48 @@ class EthDataPipeline:
         return False
     
     def flush_buffer_to_new_table(self):
-        """Flush buffered messages to the new current table with batch insertion."""
-        with self.buffer_lock:
-            if self.memory_buffer:
-                buffer_count = len(self.memory_buffer)
-                print(f"📥 Flushing {buffer_count} buffered messages to new table")
+        """Flush buffered messages to the new current table with batch insertion.
+        
+        The caller holds buffer_lock.
+        """
+        if self.memory_buffer:
+            buffer_count = len(self.memory_buffer)
+            print(f"📥 Flushing {buffer_count} buffered messages to new table")
+            flushed_count = 0
+            
+            try:
+                # Sort buffer by timestamp to ensure chronological order
+                sorted_buffer = sorted(self.memory_buffer, key=lambda x: x[0])
                 
+                # Validate buffer integrity before insertion; the checks only report, so a
+                # failure in them must not divert the flush into the per-row fallback
                 try:
-                    # Reconnect to ensure we're using the new table
-                    self.connect_clickhouse()
-                    
-                    # Sort buffer by timestamp to ensure chronological order
-                    sorted_buffer = sorted(self.memory_buffer, key=lambda x: x[0])
-                    
-                    # Validate buffer integrity before insertion
                     self.validate_buffer_integrity(sorted_buffer)
-                    
-                    # Batch insert all buffered messages at once for better performance
-                    print(f"🔄 Performing batch insert of {buffer_count} messages...")
-                    self.ch_client.execute(
-                        f"INSERT INTO {self.table_name} (ts, mt, m) VALUES",
-                        sorted_buffer
-                    )
-                    
-                    print(f"✅ Successfully flushed {buffer_count} messages via batch insert")
-                    
-                    # Verify the insertion was successful
-                    self.verify_buffer_flush(buffer_count)
-                    
                 except Exception as e:
-                    print(f"❌ Failed to flush buffer: {e}")
-                    print(f"🔄 Attempting individual message recovery...")
-                    self.fallback_individual_insert()
+                    print(f"⚠️  Buffer validation failed: {e}")
+                
+                # Batch insert all buffered messages at once, sent as (ts, mt, m)
+                # columns so the driver doesn't transpose row tuples into blocks,
+                # in native-block-sized chunks to bound the size of each INSERT
+                print(f"🔄 Performing batch insert of {buffer_count} messages...")
+                columns = [list(column) for column in zip(*sorted_buffer)]
+                for start in range(0, buffer_count, FLUSH_BLOCK_SIZE):
+                    self.execute_query(
+                        self.insert_query,
+                        [column[start:start + FLUSH_BLOCK_SIZE] for column in columns],
+                        columnar=True
+                    )
+                    flushed_count = min(start + FLUSH_BLOCK_SIZE, buffer_count)
+                
+                print(f"✅ Successfully flushed {buffer_count} messages via batch insert")
+                
+                # Verify the insertion was successful
+                self.verify_buffer_flush(buffer_count, sorted_buffer[0][0], sorted_buffer[-1][0])
+                
+            except Exception as e:
+                print(f"❌ Failed to flush buffer: {e}")
+                print(f"🔄 Attempting individual message recovery from message {flushed_count}...")
+                self.fallback_individual_insert(flushed_count)
     
     def validate_buffer_integrity(self, buffer_data):
         """Validate buffer data integrity before insertion."""
@@ -162,36 +210,33 @@ class EthDataPipeline:
             
         print(f"🔍 Validating buffer integrity ({len(buffer_data)} messages)...")
         
-        # Check for duplicate timestamps
-        timestamps = [item[0] for item in buffer_data]
-        unique_timestamps = set(timestamps)
-        if len(timestamps) != len(unique_timestamps):
-            duplicate_count = len(timestamps) - len(unique_timestamps)
+        # Check for duplicate timestamps with a single hashed pass
+        timestamps, message_types, _ = zip(*buffer_data)
+        duplicate_count = len(timestamps) - len(set(timestamps))
+        if duplicate_count:
             print(f"⚠️  Found {duplicate_count} duplicate timestamps in buffer")
         
         # Check message type distribution
-        message_types = [item[1] for item in buffer_data]
-        type_counts = {}
-        for mt in message_types:
-            type_counts[mt] = type_counts.get(mt, 0) + 1
+        type_counts = dict(Counter(message_types))
         
         print(f"📊 Buffer message types: {type_counts}")
         
         # Check time span
         if len(buffer_data) > 1:
             time_span = buffer_data[-1][0] - buffer_data[0][0]
-            print(f"⏰ Buffer time span: {time_span:.3f} seconds")
+            print(f"⏰ Buffer time span: {time_span.total_seconds():.3f} seconds")
             
         print(f"✅ Buffer validation completed")
     
-    def verify_buffer_flush(self, expected_count):
+    def verify_buffer_flush(self, expected_count, min_ts, max_ts):
         """Verify that buffer flush was successful."""
         try:
-            # Get count of recently inserted messages
-            recent_count = self.ch_client.execute(f"""
-                SELECT count(*) FROM {self.table_name} 
-                WHERE ts >= now() - INTERVAL 10 SECOND
-            """)[0][0]
+            # Count messages inside the buffer's own [min, max] timestamp range rather than a
+            # fixed window behind now(); parameters bind at second precision, so round outward
+            recent_count = self.execute_query(self.range_count_query, {
+                'min_ts': min_ts.replace(microsecond=0),
+                'max_ts': max_ts.replace(microsecond=0) + timedelta(seconds=1)
+            })[0][0]
             
             if recent_count >= expected_count:
                 print(f"✅ Buffer flush verification passed: {recent_count} recent messages found")
@@ -201,16 +246,19 @@ class EthDataPipeline:
         except Exception as e:
             print(f"⚠️  Buffer flush verification failed: {e}")
     
-    def fallback_individual_insert(self):
-        """Fallback method for individual message insertion if batch fails."""
+    def fallback_individual_insert(self, skip=0):
+        """Fallback method for individual message insertion if batch fails.
+        
+        skip is the number of leading (sorted) messages already inserted by the batch flush.
+        """
         try:
-            sorted_buffer = sorted(self.memory_buffer, key=lambda x: x[0])
+            sorted_buffer = sorted(self.memory_buffer, key=lambda x: x[0])[skip:]
             success_count = 0
             
             for ts, mt, message in sorted_buffer:
                 try:
-                    self.ch_client.execute(
-                        f"INSERT INTO {self.table_name} (ts, mt, m) VALUES",
+                    self.execute_query(
+                        self.insert_query,
                         [(ts, mt, message)]
                     )
                     success_count += 1
@@ -222,36 +270,56 @@ class EthDataPipeline:
         except Exception as e:
             print(f"❌ Fallback insertion also failed: {e}")
     
-    def store_message(self, timestamp, message_type, message_data):
-        """Store message either in database or memory buffer during rotation."""
+    def store_messages(self, rows):
+        """Store (ts, mt, m) rows either in database or memory buffer during rotation.
+        
+        Returns the number of rows stored; a failed batch INSERT is retried row by row
+        so one bad row or transient error doesn't lose the whole batch.
+        """
         with self.buffer_lock:
             if self.buffer_active:
                 # Store in memory buffer during rotation
-                self.memory_buffer.append((timestamp, message_type, message_data))
-                return True
-            else:
-                # Normal database storage
+                self.memory_buffer.extend(rows)
+                return len(rows)
+            
+            # Normal database storage, one INSERT for the whole batch
+            try:
+                self.execute_query(self.insert_query, rows)
+                return len(rows)
+            except Exception as e:
+                print(f"❌ Database batch insert failed: {e}")
+                print(f"🔄 Retrying {len(rows)} messages individually...")
+        
+        # The retry runs outside the batch's critical section; the lock is taken per row so
+        # the rotation monitor can activate the buffer between round trips, and rows left
+        # once it is active go to the buffer instead of the table being renamed
+        stored = 0
+        last_error = None
+        for row in rows:
+            with self.buffer_lock:
+                if self.buffer_active:
+                    self.memory_buffer.append(row)
+                    stored += 1
+                    continue
                 try:
-                    self.ch_client.execute(
-                        f"INSERT INTO {self.table_name} (ts, mt, m) VALUES",
-                        [(timestamp, message_type, message_data)]
-                    )
-                    return True
+                    self.execute_query(self.insert_query, [row])
+                    stored += 1
                 except Exception as e:
-                    print(f"❌ Database insert failed: {e}")
-                    return False
+                    last_error = e
+        if last_error is not None:
+            print(f"⚠️  Failed to insert {len(rows) - stored} individual messages: {last_error}")
+        return stored
     
-    def extract_timestamp(self, data):
-        """Extract timestamp from MEXC message data."""
-        if 'data' in data and 'ts' in data['data']:
-            return data['data']['ts'] / 1000  # Convert to seconds
+    def extract_timestamp(self, data, payload):
+        """Extract timestamp from MEXC message data (payload is data['data'])."""
+        if 'ts' in payload:
+            return payload['ts'] / 1000  # Convert to seconds
         elif 'ts' in data:
             return data['ts'] / 1000
         return time.time()
     
-    def format_ticker_data(self, data):
-        """Format ticker data for unified message column."""
-        d = data.get('data', {})
+    def format_ticker_data(self, d):
+        """Format ticker payload for unified message column."""
         
         # Format funding rate as standard decimal (not scientific notation)
         funding_rate = d.get('fundingRate', '0')
@@ -272,17 +340,15 @@ class EthDataPipeline:
         ]
         return '|'.join(values)
     
-    def format_deal_data(self, data):
-        """Format deal data for unified message column."""
-        d = data.get('data', {})
+    def format_deal_data(self, d):
+        """Format deal payload for unified message column."""
         price = str(d.get('p', '0'))
         volume = str(d.get('v', '0'))
         direction = str(1 if d.get('T') == 1 else 2)  # 1=BUY, 2=SELL
         return f"{price}|{volume}|{direction}"
     
-    def format_depth_data(self, data):
-        """Format depth data for unified message column."""
-        d = data.get('data', {})
+    def format_depth_data(self, d):
+        """Format depth payload for unified message column."""
         
         # Format bids - use only price and amount (first 2 elements)
         bids = d.get('bids', [])
@@ -297,13 +363,17 @@ class EthDataPipeline:
     def process_message(self, message):
         """Process incoming WebSocket message."""
         try:
-            # Handle string messages (like pong responses)
-            if isinstance(message, str) and message.strip() in ['pong', 'ping']:
-                return
-            
-            # Try to parse as JSON
+            # Try to parse as JSON. Only push frames carry market data; pongs, bare ping/pong
+            # text and rs.* subscription replies are dropped on a substring check before any parsing
             if isinstance(message, str):
-                data = json.loads(message)
+                if 'push.' not in message:
+                    return
+                data = orjson.loads(message)
+            elif isinstance(message, (bytes, bytearray)):
+                # With UTF-8 validation skipped, websocket-client hands text frames over as bytes
+                if b'push.' not in message:
+                    return
+                data = orjson.loads(message)
             else:
                 data = message
             
@@ -325,32 +395,34 @@ class EthDataPipeline:
             if not channel.startswith('push.'):
                 return
             
-            timestamp = self.extract_timestamp(data)
+            # Look up the payload once and hand it to the timestamp and format helpers
+            payload = data.get('data', {})
+            timestamp = self.extract_timestamp(data, payload)
             dt = datetime.fromtimestamp(timestamp)
             
             # Determine message type and format data
-            if 'ticker' in channel:
-                msg_type = MessageType.TICKER.value
-                formatted_data = self.format_ticker_data(data)
-                self.stats['ticker_count'] += 1
-            elif 'deal' in channel:
-                msg_type = MessageType.DEAL.value
-                formatted_data = self.format_deal_data(data)
-                self.stats['deal_count'] += 1
-            elif 'depth' in channel:
-                msg_type = MessageType.DEPTH.value
-                formatted_data = self.format_depth_data(data)
-                self.stats['depth_count'] += 1
+            handler = self.channel_handlers.get(channel)
+            if handler:
+                msg_type, formatter, stats_key = handler
+                formatted_data = formatter(payload)
+                self.stats[stats_key] += 1
             else:
                 # Deadletter for unknown message types
                 msg_type = MessageType.DEADLETTER.value
-                formatted_data = str(data)[:500]  # Limit size
+                # Keep the frame as received rather than re-serializing the parsed dict
+                if isinstance(message, str):
+                    raw = message
+                elif isinstance(message, (bytes, bytearray)):
+                    raw = message.decode('utf-8', 'replace')
+                else:
+                    raw = str(data)
+                formatted_data = raw[:500]  # Limit size
                 self.stats['deadletter_count'] += 1
             
             # Insert into ClickHouse unified table
             self.insert_data(dt, msg_type, formatted_data)
             
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             # Handle non-JSON messages
             pass
         except Exception as e:
@@ -361,14 +433,35 @@ class EthDataPipeline:
                 self.running = False
     
     def insert_data(self, timestamp, msg_type, message_data):
-        """Insert data into current table or memory buffer during rotation."""
-        if self.store_message(timestamp, msg_type, message_data):
-            if not self.buffer_active:
-                print(f"✓ {msg_type} data appended to {self.table_name}")
-            self.stats['total_records'] += 1
-        else:
-            print(f"❌ {self.symbol} insert failed")
-            self.stats['errors'] += 1
+        """Queue data for the writer thread."""
+        self.write_queue.put((timestamp, msg_type, message_data))
+    
+    def write_worker(self):
+        """Insert queued data in batches into current table or memory buffer during rotation."""
+        while self.running or not self.write_queue.empty():
+            try:
+                rows = [self.write_queue.get(timeout=1)]
+            except queue.Empty:
+                continue
+            
+            # Coalesce whatever else arrives within the batch window into the same INSERT
+            deadline = time.monotonic() + INSERT_BATCH_WINDOW
+            while len(rows) < INSERT_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(self.write_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            # Successful appends are only counted here; print_statistics reports them periodically
+            stored = self.store_messages(rows)
+            self.stats['total_records'] += stored
+            lost = len(rows) - stored
+            if lost:
+                print(f"❌ {self.symbol} insert failed: {lost}/{len(rows)} messages lost")
+                self.stats['errors'] += lost
     
     def on_message(self, ws, message):
         """WebSocket message handler."""
@@ -382,6 +475,8 @@ class EthDataPipeline:
     def on_close(self, ws, close_status_code, close_msg):
         """WebSocket close handler."""
         print(f"WebSocket closed: {close_status_code} - {close_msg}")
+        if self.ping_stop:
+            self.ping_stop.set()
         if self.running and self.reconnect_count < MAX_RECONNECT_ATTEMPTS:
             print(f"Attempting reconnection in {RECONNECT_DELAY} seconds...")
             time.sleep(RECONNECT_DELAY)
@@ -393,15 +488,20 @@ class EthDataPipeline:
         self.reconnect_count = 0
         
         # Subscribe to channels
-        for sub in self.subscriptions:
-            ws.send(json.dumps(sub))
-            print(f"Subscribed to: {sub['method']} for {self.symbol}")
+        for method, frame in self.subscription_frames:
+            ws.send(frame)
+            print(f"Subscribed to: {method} for {self.symbol}")
+        
+        # Start ping thread; it exits as soon as this connection closes rather than
+        # lingering through its sleep and overlapping the next connection's thread
+        ping_stop = threading.Event()
+        self.ping_stop = ping_stop
         
-        # Start ping thread
         def ping_thread():
             while self.running and ws.sock and ws.sock.connected:
-                ws.send(json.dumps({"method": "ping"}))
-                time.sleep(PING_INTERVAL)
+                ws.send(PING_FRAME)
+                if ping_stop.wait(PING_INTERVAL):
+                    break
         
         threading.Thread(target=ping_thread, daemon=True).start()
     
@@ -416,8 +516,13 @@ class EthDataPipeline:
             on_close=self.on_close
         )
         
-        # Run in separate thread
-        ws_thread = threading.Thread(target=self.ws.run_forever, daemon=True)
+        # Run in separate thread; orjson rejects invalid UTF-8 when parsing, so skip
+        # websocket-client's per-frame pure-Python UTF-8 validation pass
+        ws_thread = threading.Thread(
+            target=self.ws.run_forever,
+            kwargs={'skip_utf8_validation': True},
+            daemon=True
+        )
         ws_thread.start()
     
     def print_statistics(self):
@@ -442,7 +547,11 @@ class EthDataPipeline:
         """Check the size of append-only file."""
         try:
             print(f"📊 Checking {self.symbol} append-only file size...")
-            count = self.ch_client.execute(f"SELECT COUNT(*) FROM {self.table_name}")[0][0]
+            # Read the row count from table metadata; scan only if the engine doesn't report it
+            result = self.execute_query(self.row_count_query, {'table': self.table_name})
+            count = result[0][0] if result else None
+            if count is None:
+                count = self.execute_query(self.count_query)[0][0]
             print(f"  {self.table_name}.bin: {count} records appended")
             
         except Exception as e:
@@ -474,6 +583,10 @@ class EthDataPipeline:
         stats_thread = threading.Thread(target=self.print_statistics, daemon=True)
         stats_thread.start()
         
+        # Start writer thread
+        self.writer_thread = threading.Thread(target=self.write_worker, daemon=True)
+        self.writer_thread.start()
+        
         # Connect to WebSocket
         self.connect_websocket()
         
@@ -489,11 +602,16 @@ class EthDataPipeline:
             if self.ws:
                 self.ws.close()
             
+            # Let the writer drain what is already queued before disconnecting
+            if self.writer_thread:
+                self.writer_thread.join(timeout=10)
+            
             print(f"Final {self.symbol} file size check...")
             self.check_file_sizes()
             
             if self.ch_client:
-                self.ch_client.disconnect()
+                with self.client_lock:
+                    self.ch_client.disconnect()
             
             print(f"{self.symbol} append-only pipeline stopped.")
 
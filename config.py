@@ -13,6 +13,7 @@ CLICKHOUSE_HTTP_PORT = int(os.getenv('CLICKHOUSE_HTTP_PORT', '8123'))
 CLICKHOUSE_USER = os.getenv('CLICKHOUSE_USER', 'default')
 CLICKHOUSE_PASSWORD = os.getenv('CLICKHOUSE_PASSWORD', '')
 CLICKHOUSE_DATABASE = 'ch_mexc'
+CLICKHOUSE_COMPRESSION = 'lz4'  # Native protocol block compression (needs lz4 + clickhouse-cityhash)
 CLICKHOUSE_TABLE = 'mexc_data'
 CLICKHOUSE_BUFFER_TABLE = 'market_data_buffer'
 
@@ -25,6 +26,9 @@ class MessageType(Enum):
 
 # Data Processing Configuration
 BUFFER_SIZE = 2000  # Emergency buffer size
+FLUSH_BLOCK_SIZE = 65536  # Rows per INSERT when flushing the rotation buffer (ClickHouse native block size)
+INSERT_BATCH_SIZE = 1000  # Max live messages coalesced into one INSERT by the writer thread
+INSERT_BATCH_WINDOW = 0.01  # seconds the writer waits for more messages before inserting
 STATS_INTERVAL = 15  # seconds
 MAX_ERROR_COUNT = 100  # Maximum errors before emergency shutdown
 
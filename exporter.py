@@ -12,16 +12,20 @@ This service rotates StripeLog tables hourly and:
 """
 
 import os
+import queue
 import sys
 import time
-import pandas as pd
+import threading
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
+from itertools import chain
 from clickhouse_driver import Client
 from config import (
     CLICKHOUSE_HOST, CLICKHOUSE_PORT, CLICKHOUSE_USER,
-    CLICKHOUSE_PASSWORD, CLICKHOUSE_DATABASE
+    CLICKHOUSE_PASSWORD, CLICKHOUSE_DATABASE, CLICKHOUSE_COMPRESSION
 )
 
 # Export configuration
@@ -32,24 +36,103 @@ CONTAINER_NAMES = {
     "eth": "mexc-eth-client", 
     "sol": "mexc-sol-client"
 }
+CONTAINER_SYMBOLS = {container: symbol for symbol, container in CONTAINER_NAMES.items()}
+# Timestamp formats for export filenames and export-log entries
+FILE_TIME_FORMAT = '%Y%m%d_%H00'
+DEBUG_FILE_TIME_FORMAT = '%Y%m%d_%H%M'
+LOG_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+EXPORT_SHARDS = 4  # Concurrent time-range scans per table export
+EXPORT_SHARD_MIN_ROWS = 100000  # Below this a single scan is cheaper than sharding
+EXPORT_COLUMNS = ('ts', 'mt', 'm')
+# Export scans read whole tables, so use larger blocks and several read threads per shard
+EXPORT_QUERY_SETTINGS = {
+    'max_block_size': 131072,
+    'max_threads': 4,
+}
+EMPTY_COLUMNS = ((), (), ())
+
+# Buffer-activity queries are fixed per symbol, so build them once at import. StripeLog has
+# no index, so the time filter scans the whole table anyway and the total row count rides along
+BUFFER_ANALYSIS_QUERY = """
+    SELECT 
+        countIf(ts >= now() - INTERVAL 10 MINUTE) as total_messages,
+        minIf(ts, ts >= now() - INTERVAL 10 MINUTE) as earliest_message,
+        maxIf(ts, ts >= now() - INTERVAL 10 MINUTE) as latest_message,
+        uniqExactIf(mt, ts >= now() - INTERVAL 10 MINUTE) as message_types,
+        countIf(ts >= now() - INTERVAL 5 MINUTE) as recent_5min,
+        count() as table_rows
+    FROM {table}
+"""
+RECENT_ACTIVITY_QUERY = "SELECT count(*) FROM {table} WHERE ts >= now() - INTERVAL 5 MINUTE"
+BUFFER_ANALYSIS_QUERIES = {symbol: BUFFER_ANALYSIS_QUERY.format(table=f"{symbol}_current") for symbol in SYMBOLS}
+RECENT_ACTIVITY_QUERIES = {symbol: RECENT_ACTIVITY_QUERY.format(table=f"{symbol}_current") for symbol in SYMBOLS}
+
+# Parquet output: explicit column types matching the ClickHouse schema, with the
+# low-cardinality mt column dictionary-encoded
+PARQUET_SCHEMA = pa.schema([
+    pa.field('ts', pa.timestamp('ms')),
+    pa.field('mt', pa.dictionary(pa.int32(), pa.string())),
+    pa.field('m', pa.string()),
+])
+PARQUET_COMPRESSION = 'zstd'
+PARQUET_COMPRESSION_LEVEL = 3
 
 class HourlyTableRotator:
     def __init__(self):
+        # Each rotation worker thread holds its own ClickHouse client
+        self._local = threading.local()
+        # Idle worker clients are kept here and reused across shards and rotation cycles
+        self._client_pool = queue.Queue()
         self.ch_client = None
         self.debug_mode = os.getenv('EXPORT_DEBUG_MODE', 'false').lower() == 'true'
+        self.export_dir = EXPORT_DIR  # Settled by the preflight checks, before any rotation worker runs
         self.connect_clickhouse()
         self.perform_preflight_checks()
+    
+    @property
+    def ch_client(self):
+        """ClickHouse client bound to the calling thread."""
+        return getattr(self._local, 'ch_client', None)
+    
+    @ch_client.setter
+    def ch_client(self, client):
+        self._local.ch_client = client
+    
+    def create_client(self):
+        """Create a new ClickHouse client."""
+        return Client(
+            host=CLICKHOUSE_HOST,
+            port=CLICKHOUSE_PORT,
+            user=CLICKHOUSE_USER,
+            password=CLICKHOUSE_PASSWORD,
+            database=CLICKHOUSE_DATABASE,
+            compression=CLICKHOUSE_COMPRESSION
+        )
+        
+    def acquire_client(self):
+        """Borrow an idle pooled ClickHouse client, creating one if none is free."""
+        try:
+            return self._client_pool.get_nowait()
+        except queue.Empty:
+            return self.create_client()
+    
+    def release_client(self, client):
+        """Return a borrowed client to the pool for reuse by later workers."""
+        self._client_pool.put(client)
+    
+    def log(self, symbol, message):
+        """Print a line tagged with the symbol it concerns, since symbol workers run concurrently.
         
+        The line goes out in one write so lines from different workers don't split each other.
+        """
+        body = message.lstrip('\n')
+        prefix = f"[{symbol.upper()}] " if symbol else ""
+        sys.stdout.write(f"{message[:len(message) - len(body)]}{prefix}{body}\n")
+    
     def connect_clickhouse(self):
         """Connect to ClickHouse database."""
         try:
-            self.ch_client = Client(
-                host=CLICKHOUSE_HOST,
-                port=CLICKHOUSE_PORT,
-                user=CLICKHOUSE_USER,
-                password=CLICKHOUSE_PASSWORD,
-                database=CLICKHOUSE_DATABASE
-            )
+            self.ch_client = self.create_client()
             print("✅ Connected to ClickHouse")
         except Exception as e:
             print(f"❌ ClickHouse connection failed: {e}")
@@ -60,7 +143,7 @@ class HourlyTableRotator:
         print("🔍 Performing pre-flight checks...")
         
         # Check and fix export directory permissions
-        self.ensure_export_directory_permissions()
+        self.export_dir = self.ensure_export_directory_permissions(self.export_dir)
         
         # Check ClickHouse connectivity
         try:
@@ -69,55 +152,107 @@ class HourlyTableRotator:
         except Exception as db_error:
             print(f"❌ ClickHouse connectivity issue: {db_error}")
         
-        # Check required tables exist
-        for symbol in SYMBOLS:
-            try:
-                current_table = f"{symbol}_current"
-                count = self.ch_client.execute(f"SELECT count(*) FROM {current_table}")[0][0]
-                print(f"✅ Table {current_table} exists ({count} rows)")
-            except Exception as table_error:
-                print(f"⚠️  Table {current_table} issue: {table_error}")
+        # Check current table schemas against the columns the export reads
+        self.validate_table_schemas()
+        
+        # Check required tables exist, reading every row count in one round-trip
+        current_tables = [f"{symbol}_current" for symbol in SYMBOLS]
+        try:
+            counts = self.get_row_counts(current_tables)
+            for current_table in current_tables:
+                if current_table in counts:
+                    print(f"✅ Table {current_table} exists ({counts[current_table]} rows)")
+                else:
+                    print(f"⚠️  Table {current_table} issue: table does not exist")
+        except Exception as table_error:
+            print(f"⚠️  Current table check failed: {table_error}")
         
         print("🔍 Pre-flight checks completed\\n")
     
-    def ensure_export_directory_permissions(self):
-        """Ensure export directory exists with proper permissions and is writable."""
+    def validate_table_schemas(self):
+        """Check every current table exposes the exported columns, using one system.columns query."""
+        try:
+            current_tables = [f"{symbol}_current" for symbol in SYMBOLS]
+            rows = self.ch_client.execute(
+                "SELECT table, name FROM system.columns WHERE database = %(database)s AND table IN %(tables)s",
+                {'database': CLICKHOUSE_DATABASE, 'tables': tuple(current_tables)}
+            )
+            table_columns = {table: set() for table in current_tables}
+            for table, column in rows:
+                table_columns[table].add(column)
+            
+            for table, columns in table_columns.items():
+                missing = [column for column in EXPORT_COLUMNS if column not in columns]
+                if missing:
+                    print(f"⚠️  Table {table} schema missing export columns: {missing}")
+                else:
+                    print(f"✅ Table {table} schema matches export columns")
+        except Exception as schema_error:
+            print(f"⚠️  Schema validation failed: {schema_error}")
+    
+    def get_row_count(self, table_name):
+        """Get a table's row count from system.tables metadata, scanning only if unavailable."""
+        result = self.ch_client.execute(
+            "SELECT total_rows FROM system.tables WHERE database = %(database)s AND name = %(table)s",
+            {'database': CLICKHOUSE_DATABASE, 'table': table_name}
+        )
+        if result and result[0][0] is not None:
+            return result[0][0]
+        return self.ch_client.execute(f"SELECT count(*) FROM {table_name}")[0][0]
+    
+    def get_row_counts(self, table_names):
+        """Get row counts for several tables from one system.tables query; absent tables are omitted."""
+        rows = self.ch_client.execute(
+            "SELECT name, total_rows FROM system.tables WHERE database = %(database)s AND name IN %(tables)s",
+            {'database': CLICKHOUSE_DATABASE, 'tables': tuple(table_names)}
+        )
+        return {
+            name: total_rows if total_rows is not None else self.ch_client.execute(f"SELECT count(*) FROM {name}")[0][0]
+            for name, total_rows in rows
+        }
+    
+    def ensure_export_directory_permissions(self, export_dir, symbol=None):
+        """Ensure export directory exists with proper permissions and is writable.
+        
+        Returns the directory to export into: export_dir, or a fallback if it is unusable.
+        """
         import stat
         import pwd
         import grp
         
-        print(f"🔧 Ensuring export directory permissions...")
+        self.log(symbol, f"🔧 Ensuring export directory permissions...")
         
         try:
             # Create directory if it doesn't exist
-            os.makedirs(EXPORT_DIR, exist_ok=True)
-            print(f"✅ Export directory accessible: {EXPORT_DIR}")
+            os.makedirs(export_dir, exist_ok=True)
+            self.log(symbol, f"✅ Export directory accessible: {export_dir}")
             
             # Get current directory stats
-            dir_stat = os.stat(EXPORT_DIR)
+            dir_stat = os.stat(export_dir)
             current_uid = os.getuid()
             current_gid = os.getgid()
             
-            print(f"🔍 Directory owner: {dir_stat.st_uid}:{dir_stat.st_gid}, Process: {current_uid}:{current_gid}")
+            self.log(symbol, f"🔍 Directory owner: {dir_stat.st_uid}:{dir_stat.st_gid}, Process: {current_uid}:{current_gid}")
             
             # Check if we can write to the directory
-            can_write = os.access(EXPORT_DIR, os.W_OK)
+            can_write = os.access(export_dir, os.W_OK)
             
             if not can_write:
-                print(f"⚠️  No write access to {EXPORT_DIR}, attempting to fix permissions...")
+                self.log(symbol, f"⚠️  No write access to {export_dir}, attempting to fix permissions...")
                 
                 # Try to set permissions to be more permissive
                 try:
-                    os.chmod(EXPORT_DIR, 0o755)
-                    print(f"✅ Set directory permissions to 755")
+                    os.chmod(export_dir, 0o755)
+                    self.log(symbol, f"✅ Set directory permissions to 755")
                 except Exception as chmod_error:
-                    print(f"⚠️  Could not change directory permissions: {chmod_error}")
+                    self.log(symbol, f"⚠️  Could not change directory permissions: {chmod_error}")
                 
                 # Check if write access is now available
-                can_write = os.access(EXPORT_DIR, os.W_OK)
+                can_write = os.access(export_dir, os.W_OK)
             
             # Test write permissions with a file
-            test_file = os.path.join(EXPORT_DIR, f".preflight_test_{int(time.time())}")
+            # Thread id keeps concurrent rotation workers from sharing a test file
+            test_file = os.path.join(export_dir, f".preflight_test_{int(time.time())}_{threading.get_ident()}")
             try:
                 with open(test_file, 'w') as f:
                     f.write('preflight_test')
@@ -127,104 +262,99 @@ class HourlyTableRotator:
                 
                 # Clean up test file
                 os.remove(test_file)
-                print(f"✅ Write permissions verified and test file cleaned up")
+                self.log(symbol, f"✅ Write permissions verified and test file cleaned up")
                 
             except Exception as write_error:
-                print(f"❌ Write permission test failed: {write_error}")
+                self.log(symbol, f"❌ Write permission test failed: {write_error}")
                 
                 # Try alternative directory if main fails
-                self.setup_fallback_directory()
+                return self.setup_fallback_directory(symbol) or export_dir
                 
         except Exception as dir_error:
-            print(f"❌ Export directory setup failed: {dir_error}")
-            self.setup_fallback_directory()
+            self.log(symbol, f"❌ Export directory setup failed: {dir_error}")
+            return self.setup_fallback_directory(symbol) or export_dir
+        
+        return export_dir
     
-    def setup_fallback_directory(self):
-        """Setup fallback export directory when primary fails."""
+    def setup_fallback_directory(self, symbol=None):
+        """Setup fallback export directory when primary fails, returning it (None if none works)."""
         fallback_dirs = ["/tmp/exports", "/app/exports"]
         
         for fallback_dir in fallback_dirs:
             try:
-                print(f"🔄 Trying fallback directory: {fallback_dir}")
+                self.log(symbol, f"🔄 Trying fallback directory: {fallback_dir}")
                 os.makedirs(fallback_dir, exist_ok=True)
                 os.chmod(fallback_dir, 0o755)
                 
                 # Test write access
-                test_file = os.path.join(fallback_dir, f".fallback_test_{int(time.time())}")
+                test_file = os.path.join(fallback_dir, f".fallback_test_{int(time.time())}_{threading.get_ident()}")
                 with open(test_file, 'w') as f:
                     f.write('fallback_test')
                 os.remove(test_file)
                 
-                # Update EXPORT_DIR to fallback
-                global EXPORT_DIR
-                EXPORT_DIR = fallback_dir
-                print(f"✅ Using fallback directory: {fallback_dir}")
-                return True
+                self.log(symbol, f"✅ Using fallback directory: {fallback_dir}")
+                return fallback_dir
                 
             except Exception as fallback_error:
-                print(f"⚠️  Fallback {fallback_dir} also failed: {fallback_error}")
+                self.log(symbol, f"⚠️  Fallback {fallback_dir} also failed: {fallback_error}")
                 continue
         
-        print(f"❌ All export directory options failed - exports may not work")
-        return False
+        self.log(symbol, f"❌ All export directory options failed - exports may not work")
+        return None
     
-    def check_container_status(self, container_name, period_start, period_end):
-        """Check if container is likely to have been running during the period."""
+    def check_container_status(self, container_name, period_start, period_end, buffer_stats=None):
+        """Check if container is likely to have been running during the period.
+        
+        buffer_stats is a get_buffer_analysis() result; when given, its recent-activity
+        count is reused instead of scanning the current table again.
+        """
+        symbol = CONTAINER_SYMBOLS[container_name]
         try:
             # Simple alternative: check if the table has recent data
-            symbol = container_name.replace('mexc-', '').replace('-client', '')
-            current_table = f"{symbol}_current"
-            
-            # Check if there's data in the current table (indicates container is working)
-            recent_count = self.ch_client.execute(f"""
-                SELECT count(*) FROM {current_table} 
-                WHERE ts >= now() - INTERVAL 5 MINUTE
-            """)[0][0]
+            if buffer_stats is not None:
+                if buffer_stats['status'] == 'error':
+                    self.log(symbol, f"❌ {container_name}: Error checking status: buffer analysis failed")
+                    return False
+                recent_count = buffer_stats['recent_5min']
+            else:
+                # Check if there's data in the current table (indicates container is working)
+                recent_count = self.ch_client.execute(RECENT_ACTIVITY_QUERIES[symbol])[0][0]
             
             if recent_count > 0:
-                print(f"✅ {container_name}: Active (recent data detected)")
+                self.log(symbol, f"✅ {container_name}: Active (recent data detected)")
                 return True
             else:
-                print(f"⚠️  {container_name}: No recent data (last 5 minutes)")
+                self.log(symbol, f"⚠️  {container_name}: No recent data (last 5 minutes)")
                 return False
                 
         except Exception as e:
-            print(f"❌ {container_name}: Error checking status: {e}")
+            self.log(symbol, f"❌ {container_name}: Error checking status: {e}")
             return False
     
     def get_buffer_analysis(self, symbol):
         """Analyze buffer activity by checking data patterns."""
         try:
-            current_table = f"{symbol}_current"
-            
             # Get recent data patterns to understand buffer activity
-            recent_data = self.ch_client.execute(f"""
-                SELECT 
-                    count(*) as total_messages,
-                    min(ts) as earliest_message,
-                    max(ts) as latest_message,
-                    count(DISTINCT mt) as message_types
-                FROM {current_table} 
-                WHERE ts >= now() - INTERVAL 10 MINUTE
-            """)
+            recent_data = self.ch_client.execute(BUFFER_ANALYSIS_QUERIES[symbol])
+            table_rows = recent_data[0][5] if recent_data else 0
             
             if recent_data and recent_data[0][0] > 0:
-                total, earliest, latest, types = recent_data[0]
+                total, earliest, latest, types, recent_5min, _ = recent_data[0]
                 duration = (latest - earliest).total_seconds() if latest and earliest else 0
                 rate = total / duration if duration > 0 else 0
                 
-                print(f"📊 {symbol.upper()} Buffer Analysis:")
-                print(f"    Recent messages (10min): {total}")
-                print(f"    Message rate: {rate:.2f} msg/sec")
-                print(f"    Message types active: {types}")
-                return {'status': 'active', 'rate': rate, 'total': total}
+                self.log(symbol, f"📊 {symbol.upper()} Buffer Analysis:")
+                self.log(symbol, f"    Recent messages (10min): {total}")
+                self.log(symbol, f"    Message rate: {rate:.2f} msg/sec")
+                self.log(symbol, f"    Message types active: {types}")
+                return {'status': 'active', 'rate': rate, 'total': total, 'recent_5min': recent_5min, 'table_rows': table_rows}
             else:
-                print(f"⚠️  {symbol.upper()} Buffer Analysis: No recent activity")
-                return {'status': 'inactive', 'rate': 0, 'total': 0}
+                self.log(symbol, f"⚠️  {symbol.upper()} Buffer Analysis: No recent activity")
+                return {'status': 'inactive', 'rate': 0, 'total': 0, 'recent_5min': 0, 'table_rows': table_rows}
                 
         except Exception as e:
-            print(f"❌ Failed to analyze {symbol} buffer: {e}")
-            return {'status': 'error', 'rate': 0, 'total': 0}
+            self.log(symbol, f"❌ Failed to analyze {symbol} buffer: {e}")
+            return {'status': 'error', 'rate': 0, 'total': 0, 'recent_5min': 0, 'table_rows': None}
     
     def signal_rotation_start(self, symbol):
         """Signal client to activate memory buffer."""
@@ -232,10 +362,10 @@ class HourlyTableRotator:
         try:
             with open(flag_file, 'w') as f:
                 f.write(str(datetime.now()))
-            print(f"🚨 Rotation signal sent to {symbol} client")
+            self.log(symbol, f"🚨 Rotation signal sent to {symbol} client")
             return True
         except Exception as e:
-            print(f"❌ Failed to signal {symbol} rotation: {e}")
+            self.log(symbol, f"❌ Failed to signal {symbol} rotation: {e}")
             return False
     
     def signal_rotation_complete(self, symbol):
@@ -244,9 +374,9 @@ class HourlyTableRotator:
         try:
             if os.path.exists(flag_file):
                 os.remove(flag_file)
-            print(f"✅ Rotation signal cleared for {symbol}")
+            self.log(symbol, f"✅ Rotation signal cleared for {symbol}")
         except Exception as e:
-            print(f"⚠️  Failed to clear rotation signal for {symbol}: {e}")
+            self.log(symbol, f"⚠️  Failed to clear rotation signal for {symbol}: {e}")
     
     def rotate_table(self, symbol):
         """Rotate current table to previous and create new current table."""
@@ -259,79 +389,111 @@ class HourlyTableRotator:
             
             # Rename current to previous (atomic operation)
             self.ch_client.execute(f"RENAME TABLE {current_table} TO {previous_table}")
-            print(f"📋 Renamed {current_table} → {previous_table}")
-            
-            # Create new current table (gets new UUID directory)
-            self.ch_client.execute(f"""
-            CREATE TABLE {current_table}
-            (
-                ts DateTime64(3),
-                mt Enum8('t' = 1, 'd' = 2, 'dp' = 3, 'dl' = 4),
-                m String
-            )
-            ENGINE = StripeLog
-            """)
-            print(f"🆕 Created new {current_table} table")
+            self.log(symbol, f"📋 Renamed {current_table} → {previous_table}")
+            
+            # Create new current table (gets new UUID directory), copying the
+            # structure and engine from the live table so it can't drift from setup
+            self.ch_client.execute(f"CREATE TABLE {current_table} AS {previous_table}")
+            self.log(symbol, f"🆕 Created new {current_table} table")
             
             return True
             
         except Exception as e:
-            print(f"❌ Failed to rotate {symbol} table: {e}")
+            self.log(symbol, f"❌ Failed to rotate {symbol} table: {e}")
             return False
     
-    def get_table_data(self, table_name):
-        """Fetch all data from specified table."""
+    def get_table_data(self, symbol, table_name):
+        """Fetch all data from specified table, scanning time-range shards concurrently.
+        
+        Returns a (ts, mt, m) tuple of column sequences rather than per-row tuples.
+        """
+        try:
+            start, end, total = self.ch_client.execute(
+                f"SELECT min(ts), max(ts), count() FROM {table_name}"
+            )[0]
+            
+            if total < EXPORT_SHARD_MIN_ROWS or start == end:
+                result = self.fetch_table_shard(self.ch_client, table_name, None, None)
+            else:
+                # Split [start, end] into equal sub-ranges; outer shards stay unbounded
+                # so rows at the extremes are never lost to boundary truncation
+                edges = [start + (end - start) * i / EXPORT_SHARDS for i in range(EXPORT_SHARDS + 1)]
+                bounds = [
+                    (edges[i] if i > 0 else None, edges[i + 1] if i < EXPORT_SHARDS - 1 else None)
+                    for i in range(EXPORT_SHARDS)
+                ]
+                self.log(symbol, f"🔀 Scanning {table_name} in {EXPORT_SHARDS} time-range shards ({total} rows)")
+                
+                with ThreadPoolExecutor(max_workers=EXPORT_SHARDS) as executor:
+                    shards = list(executor.map(lambda b: self._fetch_shard_worker(table_name, *b), bounds))
+                
+                # Shards are disjoint and individually ordered, so concatenation keeps ts order
+                result = tuple(
+                    list(chain.from_iterable(shard[i] for shard in shards))
+                    for i in range(len(EXPORT_COLUMNS))
+                )
+            
+            if result[0]:
+                self.log(symbol, f"🔍 DEBUG: First few rows from {table_name}: {list(zip(*(column[:3] for column in result)))}")
+                self.log(symbol, f"🔍 DEBUG: Sample mt values from DB: {list(result[1][:5])}")
+            else:
+                self.log(symbol, f"🔍 DEBUG: First few rows from {table_name}: No data")
+            return result
+        except Exception as e:
+            self.log(symbol, f"❌ Error fetching {table_name} data: {e}")
+            return EMPTY_COLUMNS
+    
+    def _get_table_data_worker(self, symbol, table_name):
+        """Fetch a table's data on a background thread with a pooled ClickHouse client."""
+        self.ch_client = self.acquire_client()
+        try:
+            return self.get_table_data(symbol, table_name)
+        finally:
+            self.release_client(self.ch_client)
+            self.ch_client = None
+    
+    def _fetch_shard_worker(self, table_name, lower, upper):
+        """Fetch one time-range shard on a worker thread with a pooled ClickHouse client."""
+        client = self.acquire_client()
+        try:
+            return self.fetch_table_shard(client, table_name, lower, upper)
+        finally:
+            self.release_client(client)
+    
+    def fetch_table_shard(self, client, table_name, lower, upper):
+        """Fetch (ts, mt, m) columns for rows with lower <= ts < upper (either bound may be None)."""
+        conditions = []
+        if lower is not None:
+            conditions.append("ts >= %(lower)s")
+        if upper is not None:
+            conditions.append("ts < %(upper)s")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
         query = f"""
         SELECT 
             ts,
             mt,
             m
         FROM {table_name}
+        {where}
         ORDER BY ts
         """
-        
-        try:
-            result = self.ch_client.execute(query)
-            print(f"🔍 DEBUG: First few rows from {table_name}: {result[:3] if result else 'No data'}")
-            if result:
-                print(f"🔍 DEBUG: Sample mt values from DB: {[row[1] for row in result[:5]]}")
-            return result
-        except Exception as e:
-            print(f"❌ Error fetching {table_name} data: {e}")
-            return []
+        # Columnar results come straight from the native blocks without building a tuple per row
+        columns = client.execute(
+            query, {'lower': lower, 'upper': upper},
+            columnar=True, settings=EXPORT_QUERY_SETTINGS
+        )
+        return tuple(columns) if columns else EMPTY_COLUMNS
     
     def export_to_parquet(self, symbol, data, period_start):
-        """Export data to Parquet file."""
-        if not data:
-            print(f"⚠️  No data to export for {symbol}")
+        """Export (ts, mt, m) columns to Parquet file."""
+        ts_values, mt_values, m_values = data
+        if not ts_values:
+            self.log(symbol, f"⚠️  No data to export for {symbol}")
             return None
             
-        print(f"🔍 TRACE: Starting export for {symbol} with {len(data)} records")
-        print(f"🔍 TRACE: Raw data first 2 rows: {data[:2]}")
-        
-        # STEP 1: Extract mt values from raw data
-        raw_mt_values = [row[1] for row in data[:10]]  # Get first 10 mt values
-        print(f"🔍 TRACE: Raw mt values from data tuples: {raw_mt_values}")
-        print(f"🔍 TRACE: Raw mt value types: {[type(x) for x in raw_mt_values[:5]]}")
-        
-        # STEP 2: Convert to DataFrame
-        df = pd.DataFrame(data, columns=['ts', 'mt', 'm'])
-        print(f"🔍 TRACE: DataFrame created successfully")
-        
-        # STEP 3: Check DataFrame mt column immediately after creation
-        print(f"🔍 TRACE: DataFrame mt values (first 10): {df['mt'].head(10).tolist()}")
-        print(f"🔍 TRACE: DataFrame mt dtype: {df['mt'].dtype}")
-        print(f"🔍 TRACE: DataFrame mt unique values: {df['mt'].unique()}")
-        print(f"🔍 TRACE: DataFrame mt value counts: {df['mt'].value_counts()}")
-        print(f"🔍 TRACE: DataFrame mt null count: {df['mt'].isnull().sum()}")
-        
-        # STEP 4: Check for any None values
-        none_mask = df['mt'].isnull()
-        if none_mask.any():
-            print(f"🔍 TRACE: Found {none_mask.sum()} None values in mt column!")
-            print(f"🔍 TRACE: None value indices: {df[none_mask].index.tolist()}")
-        else:
-            print(f"🔍 TRACE: No None values found in mt column")
+        self.log(symbol, f"🔍 TRACE: Starting export for {symbol} with {len(ts_values)} records")
+        self.log(symbol, f"🔍 TRACE: Raw data first 2 rows: {list(zip(ts_values[:2], mt_values[:2], m_values[:2]))}")
         
         # Convert mt enum to string - ClickHouse Enum8 returns string values directly
         # Map string values to themselves (no conversion needed since they're already correct)
@@ -341,309 +503,323 @@ class HourlyTableRotator:
             1: 't', 2: 'd', 3: 'dp', 4: 'dl'
         }
         
-        # STEP 5: Apply mapping with simple map() method (proven to work)
-        print(f"🔍 TRACE: Starting mapping process...")
-        original_mt_values = df['mt'].tolist()
-        print(f"🔍 TRACE: Original mt values before mapping: {set(original_mt_values)}")
-        print(f"🔍 TRACE: Mapping dictionary: {mt_map}")
-        
-        # Use simple map() method - this approach works in debug_actual_rotation.py
-        df['mt'] = df['mt'].map(mt_map)
-        print(f"🔍 TRACE: Mapping applied successfully with simple map() method")
-        
-        # STEP 6: Check mapping results
-        print(f"🔍 TRACE: Mt values after mapping (first 10): {df['mt'].head(10).tolist()}")
-        print(f"🔍 TRACE: Mt unique values after mapping: {df['mt'].unique()}")
-        print(f"🔍 TRACE: Mt value counts after mapping: {df['mt'].value_counts()}")
-        print(f"🔍 TRACE: Mt column dtype after mapping: {df['mt'].dtype}")
+        mapped_mt = [mt_map.get(mt) for mt in mt_values]
         
-        # Verify no null values
-        null_count = df['mt'].isnull().sum()
+        # Verify no unmapped values
+        null_count = mapped_mt.count(None)
         if null_count > 0:
-            print(f"⚠️  TRACE: {null_count} null values found after mapping - this should not happen!")
-            # Force fill any remaining nulls
-            df['mt'] = df['mt'].fillna('dl')
-            print(f"🔍 TRACE: Filled remaining nulls with 'dl'")
+            self.log(symbol, f"⚠️  TRACE: {null_count} unmapped mt values found - this should not happen!")
+            # Force fill any unmapped values
+            mapped_mt = [mt if mt is not None else 'dl' for mt in mapped_mt]
+            self.log(symbol, f"🔍 TRACE: Filled unmapped values with 'dl'")
         else:
-            print(f"✅ TRACE: No null values found after mapping")
-            
-        print(f"🔍 TRACE: Final mt values after mapping: {df['mt'].value_counts()}")
+            self.log(symbol, f"✅ TRACE: No unmapped mt values found")
         
         # Force flush stdout to ensure debug prints appear
-        import sys
         sys.stdout.flush()
         
         # Create filename based on mode
         if self.debug_mode:
-            filename = f"{symbol}_{period_start.strftime('%Y%m%d_%H%M')}_debug.parquet"
+            filename = f"{symbol}_{period_start:{DEBUG_FILE_TIME_FORMAT}}_debug.parquet"
         else:
-            filename = f"{symbol}_{period_start.strftime('%Y%m%d_%H')}00.parquet"
+            filename = f"{symbol}_{period_start:{FILE_TIME_FORMAT}}.parquet"
             
-        print(f"🔍 DEBUG: Creating file: {filename} in directory: {EXPORT_DIR}")
+        export_dir = self.export_dir
+        self.log(symbol, f"🔍 DEBUG: Creating file: {filename} in directory: {export_dir}")
         
-        filepath = os.path.join(EXPORT_DIR, filename)
+        # Ensure export directory exists with proper permissions; preflight already ran the
+        # full setup, so only repeat it (stat, chmod, test-file write) if access was lost.
+        # Any fallback it picks applies to this export alone, not the other symbols' workers
+        if not (os.path.isdir(export_dir) and os.access(export_dir, os.W_OK)):
+            export_dir = self.ensure_export_directory_permissions(export_dir, symbol)
         
-        # Ensure export directory exists with proper permissions
-        self.ensure_export_directory_permissions()
+        filepath = os.path.join(export_dir, filename)
         
-        print(f"📄 Final export filepath: {filepath}")
+        self.log(symbol, f"📄 Final export filepath: {filepath}")
         
-        # STEP 7: Write Parquet file with compression
+        # Write Parquet file with ZSTD compression
         try:
-            print(f"🔍 TRACE: About to create Arrow table for {symbol}")
-            print(f"🔍 TRACE: Final DataFrame shape: {df.shape}")
-            print(f"🔍 TRACE: Final DataFrame columns: {df.columns.tolist()}")
-            print(f"🔍 TRACE: Final DataFrame dtypes: {df.dtypes.to_dict()}")
-            
-            # Check mt column one more time before Arrow conversion
-            print(f"🔍 TRACE: Final mt values before Arrow: {df['mt'].value_counts()}")
-            print(f"🔍 TRACE: Final mt nulls before Arrow: {df['mt'].isnull().sum()}")
-            
-            # Create Arrow table from pandas DataFrame
-            print(f"🔍 TRACE: Creating Arrow table from pandas")
-            table = pa.Table.from_pandas(df)
-            print(f"🔍 TRACE: Arrow table created successfully")
-            print(f"🔍 TRACE: Arrow table schema: {table.schema}")
-            
-            # Check Arrow table mt column
-            mt_column = table.column('mt')
-            print(f"🔍 TRACE: Arrow mt column type: {mt_column.type}")
-            print(f"🔍 TRACE: Arrow mt column length: {len(mt_column)}")
-            
-            # Verify Arrow table mt column values
-            mt_pandas_from_arrow = mt_column.to_pandas()
-            print(f"🔍 TRACE: Arrow mt column values: {mt_pandas_from_arrow.value_counts()}")
-            print(f"🔍 TRACE: Arrow mt column nulls: {mt_pandas_from_arrow.isnull().sum()}")
-            
-            print(f"🔍 TRACE: Writing to {filepath}")
-            pq.write_table(table, filepath, compression='snappy')
-            print(f"🔍 TRACE: Parquet file written successfully")
-            
-            # STEP 8: Verify file was created and has data
+            # Build Arrow columns directly against the explicit export schema
+            # rather than letting pandas infer types
+            table = pa.Table.from_arrays([
+                pa.array(ts_values, type=pa.timestamp('ms')),
+                pa.array(mapped_mt, type=pa.string()).dictionary_encode(),
+                pa.array(m_values, type=pa.string()),
+            ], schema=PARQUET_SCHEMA)
+            self.log(symbol, f"🔍 TRACE: Arrow table schema: {table.schema}")
+            self.log(symbol, f"🔍 TRACE: Arrow mt value counts: {table.column('mt').value_counts().to_pylist()}")
+            
+            self.log(symbol, f"🔍 TRACE: Writing to {filepath}")
+            pq.write_table(
+                table, filepath,
+                compression=PARQUET_COMPRESSION,
+                compression_level=PARQUET_COMPRESSION_LEVEL,
+                use_dictionary=['mt'],
+                write_statistics=True
+            )
+            self.log(symbol, f"🔍 TRACE: Parquet file written successfully")
+            
+            # Verify file was created and has data
             file_size = os.path.getsize(filepath)
-            read_table = pq.read_table(filepath)
+            # Only the mt column is inspected, so project it and skip decoding m
+            read_table = pq.read_table(filepath, columns=['mt'])
             row_count = read_table.num_rows
             
-            print(f"🔍 TRACE: Reading back written file for verification")
-            print(f"🔍 TRACE: Read back table schema: {read_table.schema}")
-            
-            # Check mt column in read-back data
-            read_back_df = read_table.to_pandas()
-            print(f"🔍 TRACE: Read back mt values: {read_back_df['mt'].value_counts()}")
-            print(f"🔍 TRACE: Read back mt nulls: {read_back_df['mt'].isnull().sum()}")
+            self.log(symbol, f"🔍 TRACE: Read back table schema: {pq.read_schema(filepath)}")
+            self.log(symbol, f"🔍 TRACE: Read back mt value counts: {read_table.column('mt').value_counts().to_pylist()}")
+            self.log(symbol, f"🔍 TRACE: Read back mt nulls: {read_table.column('mt').null_count}")
             
-            print(f"✅ Exported {symbol}: {filename} ({row_count} rows, {file_size:,} bytes)")
+            self.log(symbol, f"✅ Exported {symbol}: {filename} ({row_count} rows, {file_size:,} bytes)")
             return filepath
             
         except Exception as e:
-            print(f"❌ Failed to export {symbol} to Parquet: {e}")
+            self.log(symbol, f"❌ Failed to export {symbol} to Parquet: {e}")
             import traceback
             traceback.print_exc()
             return None
     
-    def verify_export(self, filepath, original_count):
+    def verify_export(self, symbol, filepath, original_count):
         """Verify the exported Parquet file contains the expected data."""
         try:
-            table = pq.read_table(filepath)
-            exported_count = table.num_rows
+            # The row count is in the Parquet footer, so no data pages need decoding
+            exported_count = pq.read_metadata(filepath).num_rows
             
             if exported_count == original_count:
-                print(f"✅ Verification passed: {exported_count} rows in Parquet")
+                self.log(symbol, f"✅ Verification passed: {exported_count} rows in Parquet")
                 return True
             else:
-                print(f"❌ Verification failed: Expected {original_count} rows, found {exported_count}")
+                self.log(symbol, f"❌ Verification failed: Expected {original_count} rows, found {exported_count}")
                 return False
                 
         except Exception as e:
-            print(f"❌ Failed to verify export: {e}")
+            self.log(symbol, f"❌ Failed to verify export: {e}")
             return False
     
+    def build_arrow_table(self, data):
+        """Build an Arrow table from (ts, mt, m) columns with ts typed as ms timestamps."""
+        ts_values, mt_values, m_values = data
+        return pa.Table.from_arrays([
+            pa.array(ts_values, type=pa.timestamp('ms')),
+            pa.array(mt_values),
+            pa.array(m_values, type=pa.string()),
+        ], names=list(EXPORT_COLUMNS))
+    
     def analyze_exported_data(self, symbol, data, total_count):
         """Analyze the composition of exported data to show buffer effectiveness."""
         try:
-            print(f"\n📊 DATA COMPOSITION ANALYSIS for {symbol.upper()}:")
-            print(f"    Total records exported: {total_count}")
+            self.log(symbol, f"\n📊 DATA COMPOSITION ANALYSIS for {symbol.upper()}:")
+            self.log(symbol, f"    Total records exported: {total_count}")
             
             # Count by message type
-            if data and len(data) > 0:
-                # Convert to DataFrame for analysis
-                df = pd.DataFrame(data, columns=['ts', 'mt', 'm'])
+            if total_count > 0:
+                # Analyze the columns as an Arrow table; ts arrives already typed
+                arrow_table = self.build_arrow_table(data)
                 
                 # DEBUG: Check what's in the data
-                print(f"🔍 DEBUG: Sample raw data from analyze_exported_data:")
-                print(f"    First 3 rows: {data[:3]}")
-                print(f"    Mt column types: {df['mt'].dtype}")
-                print(f"    Mt unique values: {df['mt'].unique()}")
+                self.log(symbol, f"🔍 DEBUG: Sample raw data from analyze_exported_data:")
+                self.log(symbol, f"    First 3 rows: {list(zip(*(column[:3] for column in data)))}")
+                self.log(symbol, f"    Mt column types: {arrow_table.schema.field('mt').type}")
+                self.log(symbol, f"    Mt unique values: {pc.unique(arrow_table.column('mt')).to_pylist()}")
                 
                 # Message type breakdown
-                msg_type_counts = df['mt'].value_counts().sort_index()
-                print(f"    Message type breakdown:")
+                msg_type_counts = self.mt_value_counts(arrow_table)
+                self.log(symbol, f"    Message type breakdown:")
                 for msg_type, count in msg_type_counts.items():
                     msg_name = {'t': 'ticker', 'd': 'deal', 'dp': 'depth', 'dl': 'deadletter'}.get(msg_type, msg_type)
                     percentage = (count / total_count) * 100
-                    print(f"      {msg_type} ({msg_name}): {count:,} records ({percentage:.1f}%)")
+                    self.log(symbol, f"      {msg_type} ({msg_name}): {count:,} records ({percentage:.1f}%)")
                 
-                # Time analysis
-                df['ts'] = pd.to_datetime(df['ts'])
-                time_span = df['ts'].max() - df['ts'].min()
+                # Time analysis - get_table_data returns rows ordered by ts, so the
+                # span and gaps come straight from the existing order without a re-sort
+                time_span = self.time_range(arrow_table)
                 rate = total_count / time_span.total_seconds() if time_span.total_seconds() > 0 else 0
                 
-                print(f"    Time span: {time_span}")
-                print(f"    Collection rate: {rate:.2f} messages/second")
+                self.log(symbol, f"    Time span: {time_span}")
+                self.log(symbol, f"    Collection rate: {rate:.2f} messages/second")
                 
-                # Check for gaps (potential buffer periods)
-                df_sorted = df.sort_values('ts')
-                time_diffs = df_sorted['ts'].diff().dropna()
-                large_gaps = time_diffs[time_diffs > pd.Timedelta(seconds=5)]
+                # Check for gaps (potential buffer periods) by differencing adjacent epoch-ms values
+                ts_ms = arrow_table.column('ts').cast(pa.int64())
+                time_diffs = pc.subtract(ts_ms.slice(1), ts_ms.slice(0, len(ts_ms) - 1))
+                large_gaps = pc.filter(time_diffs, pc.greater(time_diffs, 5000))
                 
                 if len(large_gaps) > 0:
-                    print(f"    ⚠️  Found {len(large_gaps)} time gaps >5s (potential buffer periods)")
-                    print(f"    Largest gap: {large_gaps.max()}")
+                    self.log(symbol, f"    ⚠️  Found {len(large_gaps)} time gaps >5s (potential buffer periods)")
+                    self.log(symbol, f"    Largest gap: {timedelta(milliseconds=pc.max(large_gaps).as_py())}")
                 else:
-                    print(f"    ✅ No significant time gaps detected")
+                    self.log(symbol, f"    ✅ No significant time gaps detected")
                 
                 # Show recent vs older data distribution
-                median_time = df_sorted['ts'].median()
-                recent_count = len(df_sorted[df_sorted['ts'] >= median_time])
-                older_count = len(df_sorted[df_sorted['ts'] < median_time])
-                print(f"    Data distribution: {older_count} older + {recent_count} recent messages")
+                # Split on the median with Arrow compute kernels over the epoch-ms values,
+                # counting the mask instead of materializing filtered DataFrames
+                median_ms = pc.quantile(ts_ms, q=0.5)[0]
+                recent_count = pc.sum(pc.greater_equal(ts_ms, median_ms)).as_py() or 0
+                older_count = total_count - recent_count
+                self.log(symbol, f"    Data distribution: {older_count} older + {recent_count} recent messages")
                 
             else:
-                print(f"    ⚠️  No data to analyze")
+                self.log(symbol, f"    ⚠️  No data to analyze")
                 
         except Exception as e:
-            print(f"    ❌ Analysis failed: {e}")
+            self.log(symbol, f"    ❌ Analysis failed: {e}")
     
-    def delete_previous_table(self, symbol):
-        """Delete the previous table completely (removes UUID directory)."""
+    def delete_previous_table(self, symbol, row_count):
+        """Delete the previous table completely (removes UUID directory).
+        
+        row_count is the number of rows already exported, used for reporting
+        so the table is not scanned again just before it is dropped.
+        """
         previous_table = f"{symbol}_previous"
         
         try:
-            # Count rows before deletion for reporting
-            count_query = f"SELECT count(*) FROM {previous_table}"
-            row_count = self.ch_client.execute(count_query)[0][0]
-            
             # Drop table completely (removes UUID directory)
             self.ch_client.execute(f"DROP TABLE {previous_table}")
             
-            print(f"🗑️  Deleted {previous_table} table and UUID directory ({row_count} rows)")
+            self.log(symbol, f"🗑️  Deleted {previous_table} table and UUID directory ({row_count} rows)")
             return True
                 
         except Exception as e:
-            print(f"❌ Failed to delete {previous_table}: {e}")
+            self.log(symbol, f"❌ Failed to delete {previous_table}: {e}")
             return False
     
     def record_export(self, symbol, period_start, filepath, row_count):
         """Record successful export in export-log.txt file."""
         try:
-            log_filepath = os.path.join(EXPORT_DIR, "export-log.txt")
+            # Log next to the export it records
+            log_filepath = os.path.join(os.path.dirname(filepath), "export-log.txt")
             export_time = datetime.now()
             file_size = os.path.getsize(filepath) if os.path.exists(filepath) else 0
             
             # Format: YYYY-MM-DD HH:MM:SS | SYMBOL | PERIOD_START | FILEPATH | ROWS | SIZE_BYTES
-            log_entry = f"{export_time.strftime('%Y-%m-%d %H:%M:%S')} | {symbol.upper()} | {period_start.strftime('%Y-%m-%d %H:%M:%S')} | {os.path.basename(filepath)} | {row_count} rows | {file_size:,} bytes\n"
+            log_entry = f"{export_time:{LOG_TIME_FORMAT}} | {symbol.upper()} | {period_start:{LOG_TIME_FORMAT}} | {os.path.basename(filepath)} | {row_count} rows | {file_size:,} bytes\n"
             
             with open(log_filepath, 'a') as log_file:
                 log_file.write(log_entry)
             
-            print(f"✅ Recorded export in {log_filepath}")
+            self.log(symbol, f"✅ Recorded export in {log_filepath}")
         except Exception as e:
-            print(f"⚠️  Failed to record export: {e}")
+            self.log(symbol, f"⚠️  Failed to record export: {e}")
+    
+    def mt_value_counts(self, table):
+        """Count rows per message type in an Arrow table, ordered by type."""
+        counts = table.column('mt').value_counts().to_pylist()
+        return dict(sorted((item['values'], item['counts']) for item in counts))
+    
+    def column_null_counts(self, table):
+        """Return {column: null_count} for the columns of an Arrow table that contain nulls."""
+        return {
+            name: column.null_count
+            for name, column in zip(table.column_names, table.columns)
+            if column.null_count
+        }
+    
+    def time_range(self, table):
+        """Span between the earliest and latest ts in an Arrow table."""
+        ts_bounds = pc.min_max(table.column('ts'))
+        return ts_bounds['max'].as_py() - ts_bounds['min'].as_py()
     
     def verify_parquet_vs_clickhouse(self, symbol, filepath):
         """Compare exported Parquet file with ClickHouse previous table."""
         previous_table = f"{symbol}_previous"
         
         try:
-            print(f"\\n🔍 VERIFICATION: Comparing {symbol} Parquet vs ClickHouse")
+            self.log(symbol, f"\\n🔍 VERIFICATION: Comparing {symbol} Parquet vs ClickHouse")
             
             # Read Parquet file
-            parquet_df = pd.read_parquet(filepath)
-            parquet_count = len(parquet_df)
-            print(f"📄 Parquet file: {parquet_count} rows")
+            parquet_table = pq.read_table(filepath)
+            parquet_count = parquet_table.num_rows
+            self.log(symbol, f"📄 Parquet file: {parquet_count} rows")
             
             # Get ClickHouse data
-            ch_data = self.get_table_data(previous_table)
-            ch_count = len(ch_data)
-            print(f"🗄️  ClickHouse table: {ch_count} rows")
+            ch_data = self.get_table_data(symbol, previous_table)
+            ch_count = len(ch_data[0])
+            self.log(symbol, f"🗄️  ClickHouse table: {ch_count} rows")
             
             # Compare counts
             if parquet_count != ch_count:
-                print(f"❌ Row count mismatch: Parquet={parquet_count}, ClickHouse={ch_count}")
+                self.log(symbol, f"❌ Row count mismatch: Parquet={parquet_count}, ClickHouse={ch_count}")
                 return False
                 
-            # Convert ClickHouse data to DataFrame for comparison
-            ch_df = pd.DataFrame(ch_data, columns=['ts', 'mt', 'm'])
+            # Compare both sides as Arrow tables, without a pandas round-trip
+            ch_table = self.build_arrow_table(ch_data)
             
             # Compare message type distributions
-            parquet_mt_counts = parquet_df['mt'].value_counts().sort_index()
-            ch_mt_counts = ch_df['mt'].value_counts().sort_index()
-            
-            print(f"📊 Message type comparison:")
-            print(f"    Parquet: {dict(parquet_mt_counts)}")
-            print(f"    ClickHouse: {dict(ch_mt_counts)}")
+            self.log(symbol, f"📊 Message type comparison:")
+            self.log(symbol, f"    Parquet: {self.mt_value_counts(parquet_table)}")
+            self.log(symbol, f"    ClickHouse: {self.mt_value_counts(ch_table)}")
             
             # Check for null values in Parquet
-            parquet_nulls = parquet_df.isnull().sum()
-            if parquet_nulls.sum() > 0:
-                print(f"⚠️  Parquet null values found: {dict(parquet_nulls[parquet_nulls > 0])}")
+            parquet_nulls = self.column_null_counts(parquet_table)
+            if parquet_nulls:
+                self.log(symbol, f"⚠️  Parquet null values found: {parquet_nulls}")
                 return False
             
             # Check for null values in ClickHouse
-            ch_nulls = ch_df.isnull().sum()
-            if ch_nulls.sum() > 0:
-                print(f"⚠️  ClickHouse null values found: {dict(ch_nulls[ch_nulls > 0])}")
+            ch_nulls = self.column_null_counts(ch_table)
+            if ch_nulls:
+                self.log(symbol, f"⚠️  ClickHouse null values found: {ch_nulls}")
                 return False
                 
             # Compare timestamps
-            parquet_time_range = parquet_df['ts'].max() - parquet_df['ts'].min()
-            ch_df['ts'] = pd.to_datetime(ch_df['ts'])
-            ch_time_range = ch_df['ts'].max() - ch_df['ts'].min()
+            parquet_time_range = self.time_range(parquet_table)
+            ch_time_range = self.time_range(ch_table)
             
-            print(f"⏰ Time range comparison:")
-            print(f"    Parquet: {parquet_time_range}")
-            print(f"    ClickHouse: {ch_time_range}")
+            self.log(symbol, f"⏰ Time range comparison:")
+            self.log(symbol, f"    Parquet: {parquet_time_range}")
+            self.log(symbol, f"    ClickHouse: {ch_time_range}")
             
             # Sample data comparison
-            print(f"🔍 Sample data comparison (first 3 rows):")
-            print(f"    Parquet mt values: {parquet_df['mt'].head(3).tolist()}")
-            print(f"    ClickHouse mt values: {ch_df['mt'].head(3).tolist()}")
+            self.log(symbol, f"🔍 Sample data comparison (first 3 rows):")
+            self.log(symbol, f"    Parquet mt values: {parquet_table.column('mt').slice(0, 3).to_pylist()}")
+            self.log(symbol, f"    ClickHouse mt values: {ch_table.column('mt').slice(0, 3).to_pylist()}")
             
-            print(f"✅ Verification passed for {symbol}")
+            self.log(symbol, f"✅ Verification passed for {symbol}")
             return True
             
         except Exception as e:
-            print(f"❌ Verification failed for {symbol}: {e}")
+            self.log(symbol, f"❌ Verification failed for {symbol}: {e}")
             return False
     
     def process_symbol_rotation(self, symbol, period_start, period_end, force_rotation=False, preserve_data=False):
         """Process complete rotation and export for a single symbol."""
         container_name = CONTAINER_NAMES[symbol]
-        print(f"\\n📊 Processing {symbol.upper()} rotation ({container_name})")
+        self.log(symbol, f"\\n📊 Processing {symbol.upper()} rotation ({container_name})")
+        
+        # Step 1: Get pre-rotation buffer analysis (also answers the container status check)
+        pre_rotation_stats = self.get_buffer_analysis(symbol)
         
         # Check container status (skip in debug mode or when forced)
         if not self.debug_mode and not force_rotation:
-            if not self.check_container_status(container_name, period_start, period_end):
-                print(f"⏭️  Skipping {symbol} - container not active during period")
+            if not self.check_container_status(container_name, period_start, period_end, pre_rotation_stats):
+                self.log(symbol, f"⏭️  Skipping {symbol} - container not active during period")
                 return False
         elif self.debug_mode:
-            print(f"🐛 DEBUG MODE: Skipping status check for {symbol}")
+            self.log(symbol, f"🐛 DEBUG MODE: Skipping status check for {symbol}")
         elif force_rotation:
-            print(f"🔧 FORCED MODE: Skipping status check for {symbol}")
+            self.log(symbol, f"🔧 FORCED MODE: Skipping status check for {symbol}")
         
-        # Step 1: Get pre-rotation buffer analysis
-        pre_rotation_stats = self.get_buffer_analysis(symbol)
+        # Skip the signal/rotate/wait cycle entirely when the table is empty; the buffer
+        # analysis already counted it, so only query again if that analysis failed
+        current_table = f"{symbol}_current"
+        try:
+            table_rows = pre_rotation_stats['table_rows']
+            if table_rows is None:
+                table_rows = self.get_row_count(current_table)
+            if table_rows == 0:
+                self.log(symbol, f"⏭️  No data in {current_table} - skipping rotation")
+                return False
+        except Exception as count_error:
+            self.log(symbol, f"⚠️  Could not read {current_table} row count, rotating anyway: {count_error}")
         
         # Step 2: Signal client to activate buffer
         if not self.signal_rotation_start(symbol):
             return False
         
         # Step 3: Wait for buffer activation and monitor
-        print(f"⏳ Waiting 2 seconds for {symbol} buffer activation...")
+        self.log(symbol, f"⏳ Waiting 2 seconds for {symbol} buffer activation...")
         time.sleep(2)
         
         # Get post-signal stats to see buffer activation
-        print(f"🔄 Monitoring {symbol} memory buffer activation...")
+        self.log(symbol, f"🔄 Monitoring {symbol} memory buffer activation...")
         
         # Step 4: Rotate tables
         if not self.rotate_table(symbol):
@@ -651,31 +827,43 @@ class HourlyTableRotator:
             return False
         
         # Step 5: Wait for client reconnection and monitor buffer flush
-        print(f"⏳ Waiting 3 seconds for {symbol} client reconnection and buffer flush...")
+        self.log(symbol, f"⏳ Waiting 3 seconds for {symbol} client reconnection and buffer flush...")
         time.sleep(1)
         
         # Monitor during reconnection
-        print(f"🔄 Monitoring {symbol} buffer flush process...")
+        self.log(symbol, f"🔄 Monitoring {symbol} buffer flush process...")
         time.sleep(2)
         
+        # A client INSERT already in flight at the rename can still land in the previous
+        # table, so only start reading it after the wait; the fetch then overlaps the
+        # post-rotation buffer analysis below
+        previous_table = f"{symbol}_previous"
+        fetch_executor = ThreadPoolExecutor(max_workers=1)
+        data_future = fetch_executor.submit(self._get_table_data_worker, symbol, previous_table)
+        fetch_executor.shutdown(wait=False)
+        
         # Get post-rotation stats to see buffer flush to new table
         post_rotation_stats = self.get_buffer_analysis(symbol)
-        print(f"✅ Post-rotation {symbol.upper()} buffer: {post_rotation_stats['status']}")
+        self.log(symbol, f"✅ Post-rotation {symbol.upper()} buffer: {post_rotation_stats['status']}")
         
         # Show buffer effectiveness
         if post_rotation_stats['total'] > 0:
-            print(f"🎯 Buffer effectiveness: {post_rotation_stats['total']} messages captured during rotation")
+            self.log(symbol, f"🎯 Buffer effectiveness: {post_rotation_stats['total']} messages captured during rotation")
         
         # Step 6: Get data from previous table
-        previous_table = f"{symbol}_previous"
-        data = self.get_table_data(previous_table)
-        if not data:
-            print(f"⏭️  No data in {previous_table} to export")
+        try:
+            data = data_future.result()
+        except Exception as e:
+            self.log(symbol, f"❌ Failed to fetch {previous_table} data: {e}")
+            self.signal_rotation_complete(symbol)
+            return False
+        original_count = len(data[0])
+        if original_count == 0:
+            self.log(symbol, f"⏭️  No data in {previous_table} to export")
             self.signal_rotation_complete(symbol)
             return False
         
-        original_count = len(data)
-        print(f"📥 Found {original_count} records to export from {previous_table}")
+        self.log(symbol, f"📥 Found {original_count} records to export from {previous_table}")
         
         # Step 6: Analyze data composition
         self.analyze_exported_data(symbol, data, original_count)
@@ -683,37 +871,37 @@ class HourlyTableRotator:
         # Step 7: Export to Parquet
         filepath = self.export_to_parquet(symbol, data, period_start)
         if not filepath:
-            print(f"❌ Export failed for {symbol}")
+            self.log(symbol, f"❌ Export failed for {symbol}")
             self.signal_rotation_complete(symbol)
             return False
         
         # Step 7: Verify export
-        if not self.verify_export(filepath, original_count):
-            print(f"❌ Verification failed for {symbol} - keeping table")
+        if not self.verify_export(symbol, filepath, original_count):
+            self.log(symbol, f"❌ Verification failed for {symbol} - keeping table")
             self.signal_rotation_complete(symbol)
             return False
         
         # Step 8: Delete previous table and UUID directory (unless preserving data)
         if preserve_data:
-            print(f"💾 Preserving {symbol}_previous table for verification")
+            self.log(symbol, f"💾 Preserving {symbol}_previous table for verification")
             # Record successful export
             self.record_export(symbol, period_start, filepath, original_count)
             # Verify the export matches ClickHouse data
             verification_success = self.verify_parquet_vs_clickhouse(symbol, filepath)
             if verification_success:
-                print(f"✅ Successfully rotated, exported, and preserved {symbol}")
+                self.log(symbol, f"✅ Successfully rotated, exported, and preserved {symbol}")
                 success = True
             else:
-                print(f"⚠️  Export completed but verification failed for {symbol}")
+                self.log(symbol, f"⚠️  Export completed but verification failed for {symbol}")
                 success = False
         else:
-            if self.delete_previous_table(symbol):
+            if self.delete_previous_table(symbol, original_count):
                 # Record successful export
                 self.record_export(symbol, period_start, filepath, original_count)
-                print(f"✅ Successfully rotated, exported, and cleaned {symbol}")
+                self.log(symbol, f"✅ Successfully rotated, exported, and cleaned {symbol}")
                 success = True
             else:
-                print(f"⚠️  Export completed but table deletion failed for {symbol}")
+                self.log(symbol, f"⚠️  Export completed but table deletion failed for {symbol}")
                 success = False
         
         # Step 9: Clear rotation signal
@@ -721,6 +909,15 @@ class HourlyTableRotator:
         
         return success
     
+    def _process_symbol_worker(self, symbol, period_start, period_end, force_rotation, preserve_data):
+        """Run a symbol rotation on a worker thread with a pooled ClickHouse client."""
+        self.ch_client = self.acquire_client()
+        try:
+            return self.process_symbol_rotation(symbol, period_start, period_end, force_rotation, preserve_data)
+        finally:
+            self.release_client(self.ch_client)
+            self.ch_client = None
+    
     def run_rotation_cycle(self, period_start, period_end, force_rotation=False, preserve_data=False):
         """Run complete rotation cycle for all symbols."""
         print(f"\\n{'='*70}")
@@ -732,10 +929,20 @@ class HourlyTableRotator:
             print(f"⏰ PRODUCTION: Processing hour: {period_start.strftime('%Y-%m-%d %H:00')} to {period_end.strftime('%Y-%m-%d %H:00')}")
         print(f"{'='*70}")
         
+        # Symbols rotate and export independently, so overlap their waits and scans
         success_count = 0
-        for symbol in SYMBOLS:
-            if self.process_symbol_rotation(symbol, period_start, period_end, force_rotation, preserve_data):
-                success_count += 1
+        with ThreadPoolExecutor(max_workers=len(SYMBOLS)) as executor:
+            futures = {
+                executor.submit(self._process_symbol_worker, symbol, period_start, period_end, force_rotation, preserve_data): symbol
+                for symbol in SYMBOLS
+            }
+            for future in as_completed(futures):
+                symbol = futures[future]
+                try:
+                    if future.result():
+                        success_count += 1
+                except Exception as e:
+                    self.log(symbol, f"❌ {symbol} rotation worker failed: {e}")
         
         print(f"\\n🎯 Rotation complete: {success_count}/{len(SYMBOLS)} symbols processed successfully")
         return success_count == len(SYMBOLS)
@@ -4,18 +4,62 @@ import time
 from clickhouse_driver import Client
 from config import (
     CLICKHOUSE_HOST, CLICKHOUSE_PORT, CLICKHOUSE_USER, 
-    CLICKHOUSE_PASSWORD, CLICKHOUSE_DATABASE, CLICKHOUSE_TABLE, CLICKHOUSE_BUFFER_TABLE
+    CLICKHOUSE_PASSWORD, CLICKHOUSE_DATABASE, CLICKHOUSE_TABLE, CLICKHOUSE_BUFFER_TABLE,
+    CLICKHOUSE_COMPRESSION
 )
 
-def drop_system_log_tables():
-    """Drop system log tables to prevent storage bloat."""
-    client = Client(
+# Tables and views from earlier layouts, dropped before the current tables are created
+LEGACY_VIEWS = ['market_data_ticker', 'market_data_deal', 'market_data_depth']
+LEGACY_TABLES = [
+    CLICKHOUSE_BUFFER_TABLE, CLICKHOUSE_TABLE,
+    'ticker', 'deal', 'depth',
+    'btc', 'eth', 'sol',
+    'btc_current', 'eth_current', 'sol_current',
+    'btc_previous', 'eth_previous', 'sol_previous',
+]
+
+SYMBOLS = ['btc', 'eth', 'sol']
+
+# Shared DDL for every symbol's current table; only the table name differs
+CURRENT_TABLE_DDL = """
+CREATE TABLE {database}.{table}
+(
+    ts DateTime64(3),
+    mt Enum8('t' = 1, 'd' = 2, 'dp' = 3, 'dl' = 4),
+    m String
+)
+ENGINE = StripeLog
+"""
+
+# Readiness probe: exponential backoff instead of a fixed startup sleep
+READY_ATTEMPTS = 15
+READY_BASE_DELAY = 0.5  # seconds, doubled per failed attempt
+READY_MAX_DELAY = 5  # seconds
+
+def wait_for(fn, attempts=READY_ATTEMPTS, base=READY_BASE_DELAY):
+    """Call fn until it succeeds, backing off exponentially; re-raise the last error."""
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise
+            delay = min(base * 2 ** attempt, READY_MAX_DELAY)
+            print(f"  Not ready yet ({e}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+
+def create_client():
+    """Create a ClickHouse client on the default database."""
+    return Client(
         host=CLICKHOUSE_HOST,
         port=CLICKHOUSE_PORT,
         user=CLICKHOUSE_USER,
-        password=CLICKHOUSE_PASSWORD if CLICKHOUSE_PASSWORD else ""
+        password=CLICKHOUSE_PASSWORD if CLICKHOUSE_PASSWORD else "",
+        compression=CLICKHOUSE_COMPRESSION
     )
-    
+
+def drop_system_log_tables(client):
+    """Drop system log tables to prevent storage bloat."""
     system_log_tables = [
         'metric_log', 'query_log', 'trace_log', 'asynchronous_metric_log',
         'processors_profile_log', 'query_thread_log', 'part_log', 'text_log',
@@ -30,90 +74,32 @@ def drop_system_log_tables():
             print(f"  Dropped system.{table}")
         except Exception as e:
             print(f"  Could not drop system.{table}: {e}")
-    
-    client.disconnect()
 
-def create_database_and_table():
-    """Create pure append-only ClickHouse tables for continuous file growth."""
-    
-    # Connect to default database first  
-    client = Client(
-        host=CLICKHOUSE_HOST,
-        port=CLICKHOUSE_PORT,
-        user=CLICKHOUSE_USER,
-        password=CLICKHOUSE_PASSWORD if CLICKHOUSE_PASSWORD else ""
-    )
+def create_database_and_table(client):
+    """Create pure append-only ClickHouse tables for continuous file growth.
     
+    Statements run on the caller's session and name tables with their database,
+    so no second connection is opened after the database is created.
+    """
     try:
         # Create database if not exists
         print(f"Creating database '{CLICKHOUSE_DATABASE}' if not exists...")
         client.execute(f"CREATE DATABASE IF NOT EXISTS {CLICKHOUSE_DATABASE}")
         
-        # Switch to the database
-        client = Client(
-            host=CLICKHOUSE_HOST,
-            port=CLICKHOUSE_PORT,
-            user=CLICKHOUSE_USER,
-            password=CLICKHOUSE_PASSWORD if CLICKHOUSE_PASSWORD else "",
-            database=CLICKHOUSE_DATABASE
-        )
-        
         # Drop any existing tables/views for clean setup
         print("Dropping existing tables if they exist...")
-        client.execute("DROP VIEW IF EXISTS market_data_ticker")
-        client.execute("DROP VIEW IF EXISTS market_data_deal") 
-        client.execute("DROP VIEW IF EXISTS market_data_depth")
-        client.execute(f"DROP TABLE IF EXISTS {CLICKHOUSE_BUFFER_TABLE}")
-        client.execute(f"DROP TABLE IF EXISTS {CLICKHOUSE_TABLE}")
-        client.execute("DROP TABLE IF EXISTS ticker")
-        client.execute("DROP TABLE IF EXISTS deal")
-        client.execute("DROP TABLE IF EXISTS depth")
-        client.execute("DROP TABLE IF EXISTS btc")
-        client.execute("DROP TABLE IF EXISTS eth")
-        client.execute("DROP TABLE IF EXISTS sol")
-        client.execute("DROP TABLE IF EXISTS btc_current")
-        client.execute("DROP TABLE IF EXISTS eth_current")
-        client.execute("DROP TABLE IF EXISTS sol_current")
-        client.execute("DROP TABLE IF EXISTS btc_previous")
-        client.execute("DROP TABLE IF EXISTS eth_previous")
-        client.execute("DROP TABLE IF EXISTS sol_previous")
+        for view in LEGACY_VIEWS:
+            client.execute(f"DROP VIEW IF EXISTS {CLICKHOUSE_DATABASE}.{view}")
+        for table in LEGACY_TABLES:
+            client.execute(f"DROP TABLE IF EXISTS {CLICKHOUSE_DATABASE}.{table}")
         
         # Create rotating StripeLog tables for hourly directory rotation
-        print("Creating btc_current table (StripeLog - rotating)...")
-        client.execute("""
-        CREATE TABLE btc_current
-        (
-            ts DateTime64(3),
-            mt Enum8('t' = 1, 'd' = 2, 'dp' = 3, 'dl' = 4),
-            m String
-        )
-        ENGINE = StripeLog
-        """)
-        
-        print("Creating eth_current table (StripeLog - rotating)...")
-        client.execute("""
-        CREATE TABLE eth_current
-        (
-            ts DateTime64(3),
-            mt Enum8('t' = 1, 'd' = 2, 'dp' = 3, 'dl' = 4),
-            m String
-        )
-        ENGINE = StripeLog
-        """)
-        
-        print("Creating sol_current table (StripeLog - rotating)...")
-        client.execute("""
-        CREATE TABLE sol_current
-        (
-            ts DateTime64(3),
-            mt Enum8('t' = 1, 'd' = 2, 'dp' = 3, 'dl' = 4),
-            m String
-        )
-        ENGINE = StripeLog
-        """)
+        for symbol in SYMBOLS:
+            print(f"Creating {symbol}_current table (StripeLog - rotating)...")
+            client.execute(CURRENT_TABLE_DDL.format(database=CLICKHOUSE_DATABASE, table=f"{symbol}_current"))
         
         # Verify setup
-        tables = client.execute("SHOW TABLES")
+        tables = client.execute(f"SHOW TABLES FROM {CLICKHOUSE_DATABASE}")
         print(f"\nTables in database '{CLICKHOUSE_DATABASE}':")
         for table in tables:
             if table[0].endswith('_current'):
@@ -133,16 +119,24 @@ def create_database_and_table():
     except Exception as e:
         print(f"Error during setup: {e}")
         sys.exit(1)
-    finally:
-        client.disconnect()
 
 if __name__ == "__main__":
-    # Wait a bit for ClickHouse to be ready if just started
     print("Setting up ClickHouse database...")
-    time.sleep(2)
     
-    # First drop system log tables to prevent storage bloat
-    drop_system_log_tables()
-    
-    # Then create our database and tables
-    create_database_and_table()
\ No newline at end of file
+    # One session serves the whole setup
+    client = create_client()
+    try:
+        # Probe until ClickHouse answers rather than sleeping a fixed time after a fresh start
+        try:
+            wait_for(lambda: client.execute("SELECT 1"))
+        except Exception as e:
+            print(f"ClickHouse not reachable: {e}")
+            sys.exit(1)
+        
+        # First drop system log tables to prevent storage bloat
+        drop_system_log_tables(client)
+        
+        # Then create our database and tables
+        create_database_and_table(client)
+    finally:
+        client.disconnect()
\ No newline at end of file
@@ -1,31 +1,58 @@
 #!/usr/bin/env python3
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from clickhouse_driver import Client
 from config import (
     CLICKHOUSE_HOST, CLICKHOUSE_PORT, CLICKHOUSE_USER,
-    CLICKHOUSE_PASSWORD, CLICKHOUSE_DATABASE, CLICKHOUSE_TABLE, CLICKHOUSE_BUFFER_TABLE
+    CLICKHOUSE_PASSWORD, CLICKHOUSE_DATABASE, CLICKHOUSE_TABLE, CLICKHOUSE_BUFFER_TABLE,
+    CLICKHOUSE_COMPRESSION
 )
 
+SYMBOL_TABLES = ['btc_current', 'eth_current', 'sol_current']
+
+# Shared by every table/message-type sample; values are bound as query parameters
+RECENT_MESSAGES_QUERY = """
+    SELECT ts, m
+    FROM {table}
+    WHERE mt = %(mt)s
+    ORDER BY ts DESC
+    LIMIT %(limit)s
+"""
+SAMPLE_MESSAGE_TYPES = ('t', 'd', 'dp')
+SAMPLE_LIMIT = 3
+
+# Per-type counts for every current symbol table in one round-trip; the table set is fixed, so build it once
+TYPE_COUNTS_QUERY = "SELECT tbl, mt, count FROM ({}) ORDER BY tbl, mt".format(" UNION ALL ".join(
+    f"SELECT '{symbol_table}' AS tbl, mt, count() AS count FROM {symbol_table} GROUP BY mt"
+    for symbol_table in SYMBOL_TABLES
+))
+
+def create_client(host):
+    """Create a ClickHouse client for the given host."""
+    return Client(
+        host=host,
+        port=CLICKHOUSE_PORT,
+        user=CLICKHOUSE_USER,
+        password=CLICKHOUSE_PASSWORD,
+        database=CLICKHOUSE_DATABASE,
+        compression=CLICKHOUSE_COMPRESSION
+    )
+
 def connect_with_retry(max_retries=3):
-    """Connect to ClickHouse with retry logic."""
+    """Connect to ClickHouse with retry logic, returning (client, host) or (None, None)."""
     # Try localhost first for external access, then fall back to configured host
     hosts_to_try = ['localhost', CLICKHOUSE_HOST] if CLICKHOUSE_HOST != 'localhost' else ['localhost']
     
     for host in hosts_to_try:
         for attempt in range(max_retries):
             try:
-                client = Client(
-                    host=host,
-                    port=CLICKHOUSE_PORT,
-                    user=CLICKHOUSE_USER,
-                    password=CLICKHOUSE_PASSWORD,
-                    database=CLICKHOUSE_DATABASE
-                )
+                client = create_client(host)
                 
                 # Test connection by checking if database exists
                 client.execute("SELECT 1")
                 print(f"✅ Connected to ClickHouse successfully at {host} (attempt {attempt + 1})")
-                return client
+                return client, host
                 
             except Exception as e:
                 print(f"❌ Connection attempt {attempt + 1} to {host} failed: {e}")
@@ -34,17 +61,46 @@ def connect_with_retry(max_retries=3):
                     time.sleep(2)
                     
     print(f"❌ Failed to connect to any host after {max_retries} attempts each")
-    return None
+    return None, None
+
+def fetch_recent_messages(host, symbol_table):
+    """Fetch the latest sample messages of each type for one table on its own connection."""
+    client = create_client(host)
+    samples = {}
+    try:
+        for msg_type in SAMPLE_MESSAGE_TYPES:
+            try:
+                samples[msg_type] = client.execute(
+                    RECENT_MESSAGES_QUERY.format(table=symbol_table),
+                    {'mt': msg_type, 'limit': SAMPLE_LIMIT}
+                )
+            except Exception as e:
+                samples[msg_type] = e
+    finally:
+        client.disconnect()
+    return samples
+
+def collect_recent_messages(sample_futures):
+    """Wait for the per-table sample queries, mapping a failed table to its error."""
+    results = {}
+    for symbol_table, future in sample_futures.items():
+        try:
+            results[symbol_table] = future.result()
+        except Exception as e:
+            results[symbol_table] = {msg_type: e for msg_type in SAMPLE_MESSAGE_TYPES}
+    return results
 
 def verify_tables_exist(client):
     """Verify required symbol-specific tables exist."""
     try:
-        btc_exists = client.execute("EXISTS TABLE btc_current")[0][0]
-        eth_exists = client.execute("EXISTS TABLE eth_current")[0][0]
-        sol_exists = client.execute("EXISTS TABLE sol_current")[0][0]
-        export_log_exists = client.execute("EXISTS TABLE export_log")[0][0]
+        # One IN-list lookup against system.tables instead of an EXISTS round-trip per table
+        existing_tables = {row[0] for row in client.execute(
+            "SELECT name FROM system.tables WHERE database = currentDatabase() AND name IN %(tables)s",
+            {'tables': tuple(SYMBOL_TABLES + ['export_log'])}
+        )}
+        export_log_exists = 'export_log' in existing_tables
         
-        if not (btc_exists and eth_exists and sol_exists):
+        if not all(symbol_table in existing_tables for symbol_table in SYMBOL_TABLES):
             print(f"❌ Current symbol tables missing - run setup_database.py first")
             return False
             
@@ -64,7 +120,7 @@ def verify_data():
     """Verify data in ClickHouse by showing last 3 entries of each type."""
     
     # Connect with retry logic
-    client = connect_with_retry()
+    client, host = connect_with_retry()
     if not client:
         print("❌ Cannot establish ClickHouse connection - aborting verification")
         sys.exit(1)
@@ -74,6 +130,7 @@ def verify_data():
         print("❌ Required tables missing - run setup_database.py first")
         sys.exit(1)
     
+    sample_executor = ThreadPoolExecutor(max_workers=len(SYMBOL_TABLES))
     try:
         print("\n" + "="*80)
         print("DATA VERIFICATION REPORT")
@@ -82,35 +139,37 @@ def verify_data():
         # Check symbol-specific file sizes
         print("💾 Symbol-specific storage status:")
         
-        # Get counts from each current symbol table
-        btc_count = client.execute("SELECT COUNT(*) FROM btc_current")[0][0]
-        eth_count = client.execute("SELECT COUNT(*) FROM eth_current")[0][0] 
-        sol_count = client.execute("SELECT COUNT(*) FROM sol_current")[0][0]
-        total_count = btc_count + eth_count + sol_count
+        # Start the per-table sample queries now so they overlap with the count query
+        sample_futures = {
+            symbol_table: sample_executor.submit(fetch_recent_messages, host, symbol_table)
+            for symbol_table in SYMBOL_TABLES
+        }
+        
+        # Get per-type counts for every current symbol table in one round-trip
+        type_counts_by_table = {symbol_table: [] for symbol_table in SYMBOL_TABLES}
+        for symbol_table, msg_type, count in client.execute(TYPE_COUNTS_QUERY):
+            type_counts_by_table[symbol_table].append((msg_type, count))
+        
+        table_totals = {
+            symbol_table: sum(count for _, count in type_counts)
+            for symbol_table, type_counts in type_counts_by_table.items()
+        }
+        total_count = sum(table_totals.values())
         
         print(f"\nTotal records in current tables: {total_count}")
-        print(f"  btc_current: {btc_count} records")
-        print(f"  eth_current: {eth_count} records")
-        print(f"  sol_current: {sol_count} records")
+        for symbol_table in SYMBOL_TABLES:
+            print(f"  {symbol_table}: {table_totals[symbol_table]} records")
         
         # Get counts by message type for each symbol
         print("\nRecords by symbol and message type:")
-        for symbol_table in ['btc_current', 'eth_current', 'sol_current']:
-            try:
-                type_counts = client.execute(f"""
-                    SELECT mt, COUNT(*) as count 
-                    FROM {symbol_table}
-                    GROUP BY mt 
-                    ORDER BY mt
-                """)
-                
-                symbol_total = sum([count for _, count in type_counts])
-                symbol_name = symbol_table.replace('_current', '').upper()
-                print(f"  {symbol_name}: {symbol_total} total")
+        for symbol_table in SYMBOL_TABLES:
+            symbol_name = symbol_table.replace('_current', '').upper()
+            type_counts = type_counts_by_table[symbol_table]
+            if type_counts:
+                print(f"  {symbol_name}: {table_totals[symbol_table]} total")
                 for msg_type, count in type_counts:
                     print(f"    {msg_type}: {count}")
-            except Exception as e:
-                symbol_name = symbol_table.replace('_current', '').upper()
+            else:
                 print(f"  {symbol_name}: No data yet")
         
         # Show last 3 ticker messages from each symbol
@@ -118,17 +177,14 @@ def verify_data():
         print("LAST 3 TICKER MESSAGES (BY SYMBOL)")
         print("-"*80)
         
-        for symbol_table in ['btc_current', 'eth_current', 'sol_current']:
+        samples = collect_recent_messages(sample_futures)
+        for symbol_table in SYMBOL_TABLES:
             symbol_name = symbol_table.replace('_current', '').upper()
             print(f"\n{symbol_name} Ticker Messages:")
             try:
-                ticker_data = client.execute(f"""
-                    SELECT ts, m
-                    FROM {symbol_table}
-                    WHERE mt = 't'
-                    ORDER BY ts DESC 
-                    LIMIT 3
-                """)
+                ticker_data = samples[symbol_table]['t']
+                if isinstance(ticker_data, Exception):
+                    raise ticker_data
                 
                 if ticker_data:
                     print("  Timestamp            | Message (lastPrice|fairPrice|indexPrice|holdVol|fundingRate)")
@@ -145,17 +201,13 @@ def verify_data():
         print("LAST 3 DEAL MESSAGES (BY SYMBOL)")
         print("-"*80)
         
-        for symbol_table in ['btc_current', 'eth_current', 'sol_current']:
+        for symbol_table in SYMBOL_TABLES:
             symbol_name = symbol_table.replace('_current', '').upper()
             print(f"\n{symbol_name} Deal Messages:")
             try:
-                deal_data = client.execute(f"""
-                    SELECT ts, m
-                    FROM {symbol_table}
-                    WHERE mt = 'd'
-                    ORDER BY ts DESC 
-                    LIMIT 3
-                """)
+                deal_data = samples[symbol_table]['d']
+                if isinstance(deal_data, Exception):
+                    raise deal_data
                 
                 if deal_data:
                     print("  Timestamp            | Message (price|volume|direction)")
@@ -172,17 +224,13 @@ def verify_data():
         print("LAST 3 DEPTH MESSAGES (BY SYMBOL)")
         print("-"*80)
         
-        for symbol_table in ['btc_current', 'eth_current', 'sol_current']:
+        for symbol_table in SYMBOL_TABLES:
             symbol_name = symbol_table.replace('_current', '').upper()
             print(f"\n{symbol_name} Depth Messages:")
             try:
-                depth_data = client.execute(f"""
-                    SELECT ts, m
-                    FROM {symbol_table}
-                    WHERE mt = 'dp'
-                    ORDER BY ts DESC 
-                    LIMIT 3
-                """)
+                depth_data = samples[symbol_table]['dp']
+                if isinstance(depth_data, Exception):
+                    raise depth_data
                 
                 if depth_data:
                     print("  Depth data (truncated for display):")
@@ -246,43 +294,56 @@ def verify_data():
         except Exception:
             print("  Volume size: Unable to check")
         
-        # Show individual symbol file info
+        # Show individual symbol table sizes
         try:
-            for symbol in ['btc_current', 'eth_current', 'sol_current']:
-                file_result = subprocess.run(['docker', 'exec', 'clickhouse', 'find', 
-                                            f'/var/lib/clickhouse/data/{CLICKHOUSE_DATABASE}/{symbol}/', 
-                                            '-name', '*.bin', '-exec', 'du', '-h', '{}', ';'], 
-                                           capture_output=True, text=True)
-                if file_result.returncode == 0 and file_result.stdout.strip():
-                    lines = file_result.stdout.strip().split('\n')
-                    for line in lines:
-                        if 'data.bin' in line:
-                            size = line.split('\t')[0]
-                            symbol_name = symbol.replace('_current', '')
-                            print(f"  {symbol_name}.bin: {size}")
+            # Table sizes come from system.tables over the open native connection; the docker
+            # exec du only runs for tables whose engine doesn't report total_bytes. Both measure
+            # the whole table (every file in its directory), not just data.bin
+            sizes = dict(client.execute(
+                "SELECT name, formatReadableSize(total_bytes) FROM system.tables "
+                "WHERE database = currentDatabase() AND name IN %(tables)s AND total_bytes IS NOT NULL",
+                {'tables': tuple(SYMBOL_TABLES)}
+            ))
+            unreported_tables = [symbol for symbol in SYMBOL_TABLES if symbol not in sizes]
+            
+            if unreported_tables:
+                # One docker exec sums every remaining table directory; output is streamed
+                # line by line and attributed back by path
+                table_dirs = {
+                    f'/var/lib/clickhouse/data/{CLICKHOUSE_DATABASE}/{symbol}/': symbol
+                    for symbol in unreported_tables
+                }
+                with subprocess.Popen(['docker', 'exec', 'clickhouse', 'du', '-sh', *table_dirs], 
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True) as du_proc:
+                    for line in du_proc.stdout:
+                        size, _, path = line.rstrip('\n').partition('\t')
+                        if path in table_dirs:
+                            sizes[table_dirs[path]] = size
+            
+            for symbol in SYMBOL_TABLES:
+                symbol_name = symbol.replace('_current', '')
+                if symbol in sizes:
+                    print(f"  {symbol_name} table size: {sizes[symbol]}")
                 else:
-                    symbol_name = symbol.replace('_current', '')
-                    print(f"  {symbol_name}.bin: File not found yet")
+                    print(f"  {symbol_name} table size: Table not found yet")
         except Exception:
-            print("  Individual file sizes: Unable to check")
+            print("  Individual table sizes: Unable to check")
         
         # Show export directory if it exists
         try:
-            export_result = subprocess.run(['ls', '-la', 'exports/'], 
-                                          capture_output=True, text=True)
-            if export_result.returncode == 0:
+            # One directory read with the sizes from scandir, instead of forking ls and parsing it
+            if os.path.isdir('exports/'):
                 print("\n  Export directory contents:")
-                lines = export_result.stdout.strip().split('\n')
-                parquet_files = [line for line in lines if '.parquet' in line]
+                with os.scandir('exports/') as entries:
+                    parquet_files = sorted(
+                        (entry.name, entry.stat().st_size)
+                        for entry in entries if entry.name.endswith('.parquet')
+                    )
                 if parquet_files:
                     print(f"    {len(parquet_files)} parquet files found")
                     # Show last few exports
-                    for line in parquet_files[-3:]:
-                        parts = line.split()
-                        if len(parts) >= 9:
-                            filename = parts[-1]
-                            size = parts[4]
-                            print(f"      {filename} ({size} bytes)")
+                    for filename, size in parquet_files[-3:]:
+                        print(f"      {filename} ({size} bytes)")
                 else:
                     print("    No parquet files found")
         except Exception:
@@ -303,6 +364,7 @@ def verify_data():
             print("💡 Hint: Tables missing? Try: python setup_database.py")
         sys.exit(1)
     finally:
+        sample_executor.shutdown(wait=True)
         if client:
             client.disconnect()
 
@@ -9,14 +9,15 @@ import json
 import sys
 import time
 import requests
-from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
 
 
-def run_docker_command(command: str) -> Tuple[bool, str]:
-    """Run a docker command and return success status and output."""
+def run_docker_command(command: List[str]) -> Tuple[bool, str]:
+    """Run a docker command (as an argv list) and return success status and output."""
     try:
         result = subprocess.run(
-            command.split(),
+            command,
             capture_output=True,
             text=True,
             timeout=30
@@ -28,40 +29,55 @@ def run_docker_command(command: str) -> Tuple[bool, str]:
         return False, str(e)
 
 
+def list_running_containers() -> Set[str]:
+    """Return the names of all running containers.
+    
+    Asks the Docker Engine API over its socket in one request, falling back to the
+    docker CLI when the docker SDK is not installed or the API reports an error.
+    """
+    try:
+        import docker
+    except ImportError:
+        print("⚠️  Docker SDK not installed, listing containers with docker ps")
+    else:
+        try:
+            docker_client = docker.from_env()
+            try:
+                return {
+                    name.lstrip('/')
+                    for container in docker_client.api.containers()
+                    for name in container['Names']
+                }
+            finally:
+                docker_client.close()
+        except docker.errors.DockerException as e:
+            print(f"⚠️  Docker API error ({e}), listing containers with docker ps")
+    
+    success, output = run_docker_command(["docker", "ps", "--format", "{{.Names}}"])
+    return set(output.splitlines()) if success else set()
+
+
 def check_container_status() -> List[str]:
     """Check if client containers are running and return their names."""
     print("📋 Checking container status...")
     
-    # Get running containers
-    success, output = run_docker_command("docker compose ps -q client-btc client-eth client-sol")
+    # Get container names that are actually running
+    container_names = ["client-btc", "client-eth", "client-sol"]
+    running_names = list_running_containers()
+    running_containers = [container for container in container_names if container in running_names]
     
-    if not success or not output:
+    if not running_containers:
         print("❌ No client containers are running. Start deployment first:")
         print("   docker compose up -d")
         sys.exit(1)
     
-    # Get container names that are actually running
-    container_names = ["client-btc", "client-eth", "client-sol"]
-    running_containers = []
-    
-    for container in container_names:
-        success, _ = run_docker_command(f"docker ps --format {{{{.Names}}}} --filter name={container}")
-        if success:
-            running_containers.append(container)
-    
     return running_containers
 
 
 def get_container_ip(container_name: str) -> Optional[str]:
-    """Get the external IP address of a container via Tor proxy."""
+    """Get the external IP address of a running container via Tor proxy."""
     print(f"Testing {container_name}...")
     
-    # Check if container is actually running
-    success, output = run_docker_command(f"docker ps --format {{{{.Names}}}} --filter name={container_name}")
-    if not success or container_name not in output:
-        print(f"  {container_name}: Not running")
-        return None
-    
     # Get IP via Tor proxy
     try:
         result = subprocess.run([
@@ -116,6 +132,14 @@ def get_location_info(container_name: str, ip: str) -> str:
     return "Unknown"
 
 
+def probe_container(container_name: str) -> Tuple[Optional[str], Optional[str]]:
+    """Get a container's external IP and, if found, its location."""
+    ip = get_container_ip(container_name)
+    if not ip:
+        return None, None
+    return ip, get_location_info(container_name, ip)
+
+
 def analyze_ip_separation(container_ips: Dict[str, str]) -> None:
     """Analyze IP separation and display results."""
     print("📊 IP Separation Analysis:")
@@ -173,14 +197,16 @@ def main():
     print("🌐 Testing IP separation for each container...")
     print("")
     
-    # Test each container
+    # Test each container; the proxy round trips are independent, so run them concurrently
+    # and report in container order
     container_ips = {}
     
-    for container in running_containers:
-        ip = get_container_ip(container)
+    with ThreadPoolExecutor(max_workers=len(running_containers)) as executor:
+        probes = list(executor.map(probe_container, running_containers))
+    
+    for container, (ip, location) in zip(running_containers, probes):
         if ip:
             container_ips[container] = ip
-            location = get_location_info(container, ip)
             symbol = container.split('-')[1].upper()
             print(f"  ✅ {symbol} Container ({container}):")
             print(f"     IP: {ip}")
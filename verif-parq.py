@@ -4,7 +4,12 @@
 import pandas as pd
 import os
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from itertools import islice
+
+READ_WORKERS = 8  # Parquet files decoded concurrently per directory
 
 def extract_asset_from_filename(filename):
     """Extract asset name from parquet filename"""
@@ -41,15 +46,20 @@ def show_recent_entries_by_message_type(df, asset_name, filename):
     unique_types = df_sorted['mt'].unique()
     total_samples = 0
     
+    # One grouped pass keeps the 3 most recent rows of every type, instead of a full
+    # boolean mask over the frame per type
+    recent = df_sorted.groupby('mt', sort=False, observed=True).head(3)
+    recent_by_type = dict(tuple(recent.groupby('mt', sort=False, observed=True)))
+    
     for mt in sorted(unique_types):
         mt_name = mt_names.get(mt, mt)
-        mt_data = df_sorted[df_sorted['mt'] == mt].head(3)
+        mt_data = recent_by_type.get(mt, recent.iloc[0:0])
         
         if len(mt_data) > 0:
             print(f"\n📊 {mt.upper()} ({mt_name}) - {len(mt_data)} most recent entries:")
-            for i, row in mt_data.iterrows():
-                ts_str = row['ts'].strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]  # milliseconds
-                message = row['m']
+            # Format the timestamps in one vectorized pass, then walk the columns directly
+            ts_strs = mt_data['ts'].dt.strftime('%Y-%m-%d %H:%M:%S.%f').str[:-3]  # milliseconds
+            for ts_str, message in zip(ts_strs, mt_data['m']):
                 
                 # Truncate long messages for display
                 if len(message) > 80:
@@ -87,66 +97,83 @@ def test_all_parquet_files():
             print(f"⚠️  Directory doesn't exist: {location}")
             continue
             
-        parquet_files = [f for f in os.listdir(location) if f.endswith('.parquet')]
+        # Single scandir pass collects names, paths and mtimes without a separate stat per file
+        with os.scandir(location) as entries:
+            file_info = [
+                (entry.name, entry.path, entry.stat().st_mtime)
+                for entry in entries if entry.name.endswith('.parquet')
+            ]
         
-        if not parquet_files:
+        if not file_info:
             print(f"⚠️  No parquet files found in {location}")
             continue
             
-        print(f"📁 Found {len(parquet_files)} parquet files")
+        print(f"📁 Found {len(file_info)} parquet files")
         
         # Sort files by modification time (newest first)
-        file_info = []
-        for filename in parquet_files:
-            filepath = os.path.join(location, filename)
-            mtime = os.path.getmtime(filepath)
-            file_info.append((filename, filepath, mtime))
-        
         file_info.sort(key=lambda x: x[2], reverse=True)  # Sort by mtime descending
         
-        for filename, filepath, mtime in file_info:
-            files_found += 1
+        # Read the files concurrently (Parquet decode releases the GIL) and report in mtime order;
+        # at most READ_WORKERS reads are in flight, and the next file is submitted only as each
+        # result is consumed, so decoded frames never pile up ahead of the report
+        with ThreadPoolExecutor(max_workers=min(READ_WORKERS, len(file_info))) as executor:
+            pending_paths = iter([filepath for _, filepath, _ in file_info])
+            read_futures = deque(
+                executor.submit(pd.read_parquet, filepath)
+                for filepath in islice(pending_paths, READ_WORKERS)
+            )
             
-            try:
-                print(f"\n🔍 Processing: {filename}")
-                df = pd.read_parquet(filepath)
-                
-                # Extract asset name from filename
-                asset_name = extract_asset_from_filename(filename)
-                
-                # Basic file info
-                file_time = datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')
-                print(f"    📄 File created: {file_time}")
-                print(f"    📊 Shape: {df.shape}")
-                print(f"    📋 Columns: {df.columns.tolist()}")
+            for filename, filepath, mtime in file_info:
+                read_future = read_futures.popleft()
+                next_path = next(pending_paths, None)
+                if next_path is not None:
+                    read_futures.append(executor.submit(pd.read_parquet, next_path))
+                files_found += 1
                 
-                # Check mt column health
-                if 'mt' in df.columns:
-                    null_count = df['mt'].isnull().sum()
-                    unique_values = sorted(df['mt'].unique())
-                    value_counts = df['mt'].value_counts()
+                try:
+                    print(f"\n🔍 Processing: {filename}")
+                    df = read_future.result()
                     
-                    print(f"    🔍 MT unique values: {unique_values}")
-                    print(f"    📈 MT distribution: {dict(value_counts)}")
+                    # Extract asset name from filename
+                    asset_name = extract_asset_from_filename(filename)
                     
-                    if null_count == 0 and len(unique_values) > 0 and 'dl' not in unique_values:
-                        print(f"    ✅ MT column healthy - no nulls, no deadletters")
-                        files_passed += 1
+                    # Basic file info
+                    file_time = datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')
+                    print(f"    📄 File created: {file_time}")
+                    print(f"    📊 Shape: {df.shape}")
+                    print(f"    📋 Columns: {df.columns.tolist()}")
+                    
+                    # Check mt column health
+                    if 'mt' in df.columns:
+                        # One counting pass gives the nulls, distinct values and distribution
+                        mt_counts = df['mt'].value_counts(dropna=False)
+                        mt_counts = mt_counts[mt_counts > 0]
+                        null_mask = mt_counts.index.isna()
+                        null_count = int(mt_counts[null_mask].sum())
+                        value_counts = mt_counts[~null_mask]
+                        unique_values = sorted(value_counts.index)
+                        
+                        print(f"    🔍 MT unique values: {unique_values}")
+                        print(f"    📈 MT distribution: {dict(value_counts)}")
                         
-                        # Show recent entries by message type
-                        samples_shown = show_recent_entries_by_message_type(df, asset_name, filename)
-                        if samples_shown:
-                            total_samples_shown += 1
+                        if null_count == 0 and len(unique_values) > 0 and 'dl' not in unique_values:
+                            print(f"    ✅ MT column healthy - no nulls, no deadletters")
+                            files_passed += 1
                             
-                    elif 'dl' in unique_values:
-                        print(f"    ⚠️  Found deadletter messages - may indicate enum mapping issues")
+                            # Show recent entries by message type
+                            samples_shown = show_recent_entries_by_message_type(df, asset_name, filename)
+                            if samples_shown:
+                                total_samples_shown += 1
+                                
+                        elif 'dl' in unique_values:
+                            print(f"    ⚠️  Found deadletter messages - may indicate enum mapping issues")
+                        else:
+                            print(f"    ❌ MT column issues: {null_count} nulls")
                     else:
-                        print(f"    ❌ MT column issues: {null_count} nulls")
-                else:
-                    print(f"    ❌ No mt column found")
-                    
-            except Exception as e:
-                print(f"    ❌ Error reading {filename}: {e}")
+                        print(f"    ❌ No mt column found")
+                        
+                except Exception as e:
+                    print(f"    ❌ Error reading {filename}: {e}")
     
     print(f"\n{'='*60}")
     print(f"📊 VERIFICATION SUMMARY:")